@@ -0,0 +1,118 @@
+"""
+Compares the matplotlib and native hourly chart engines for speed and output
+
+Renders are timed cold, with a new matplotlib figure every run, and warm,
+where matplotlib redraws only the lines over its cached background because
+the data is the same as last time. The speedup is computed from the cold
+times, which is what a refresh with new forecast data costs.
+
+The outputs are compared pixel by pixel, allowing each pixel to match
+anywhere within 1 pixel in the other image so antialiasing doesn't count.
+A pixel mismatches if it differs by more than --threshold grey levels.
+Inside the axes, where the grid, ticks and lines are, the native engine
+must stay within --plot-tolerance of matplotlib, which catches a missing
+grid line or a shifted axis. The whole frame must stay within
+--tolerance, which is looser because the tick labels use the display's
+font rather than matplotlib's.
+
+Usage:
+    python benchmarks/chart.py [--runs 5] [--hours 24] [--save-dir /tmp]
+"""
+
+import argparse
+import math
+import os
+import time
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from PIL import ImageFilter
+from rpi_weather_display import create_hourly_image, image
+from rpi_weather_display.chart import panel_boxes, plot_left, plot_right
+
+
+def sample_hourly_data(hours: int = 24):
+    start = datetime(2022, 11, 1, 12, tzinfo=timezone.utc)
+    return [
+        {
+            "time": start + timedelta(hours=i),
+            "temperature": 10 + 5 * math.sin(i / 4),
+            "rain": max(0, math.sin(i / 3)) * 2,
+        }
+        for i in range(hours)
+    ]
+
+
+def timed(engine: str, data: list, runs: int, cold: bool):
+    best = None
+    for _ in range(runs):
+        if cold:
+            image._hourly_plots.clear()
+        start = time.perf_counter()
+        img = create_hourly_image(data, engine=engine)
+        img.load()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return img.convert("L"), best
+
+
+def mismatched(a, b, threshold: int):
+    """
+    Returns a boolean array of the pixels of a that differ by more than
+    threshold from every pixel within 1 pixel of them in b
+    """
+    pixels = np.asarray(a, dtype=np.int16)
+    low = np.asarray(b.filter(ImageFilter.MinFilter(3)), dtype=np.int16)
+    high = np.asarray(b.filter(ImageFilter.MaxFilter(3)), dtype=np.int16)
+    return (pixels < low - threshold) | (pixels > high + threshold)
+
+
+def plot_area(shape: tuple):
+    """
+    Returns a boolean array of the pixels inside the axes, without the spines
+    """
+    mask = np.zeros(shape, dtype=bool)
+    for top, bottom in panel_boxes.values():
+        rows = slice(math.ceil(top), math.floor(bottom) - 2)
+        mask[rows, plot_left + 2:math.floor(plot_right)] = True
+    return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", default=5, type=int)
+    parser.add_argument("--hours", default=24, type=int)
+    parser.add_argument("--threshold", default=64, type=int)
+    parser.add_argument("--tolerance", default=0.025, type=float)
+    parser.add_argument("--plot-tolerance", default=0.002, type=float)
+    parser.add_argument("--save-dir", default=None, type=str)
+    config = parser.parse_args()
+
+    data = sample_hourly_data(config.hours)
+    mpl_img, mpl_cold = timed("matplotlib", data, config.runs, cold=True)
+    _, mpl_warm = timed("matplotlib", data, config.runs, cold=False)
+    native_img, native_cold = timed("native", data, config.runs, cold=True)
+    _, native_warm = timed("native", data, config.runs, cold=False)
+
+    diff = mismatched(mpl_img, native_img, config.threshold) | mismatched(
+        native_img, mpl_img, config.threshold
+    )
+    mismatch = float(np.mean(diff))
+    plot_mismatch = float(np.mean(diff[plot_area(diff.shape)]))
+
+    if config.save_dir:
+        mpl_img.save(os.path.join(config.save_dir, "hourly-matplotlib.png"))
+        native_img.save(os.path.join(config.save_dir, "hourly-native.png"))
+
+    print("              cold      warm")
+    print(f"matplotlib: {mpl_cold * 1000:6.1f} ms {mpl_warm * 1000:6.1f} ms")
+    print(f"native:     {native_cold * 1000:6.1f} ms {native_warm * 1000:6.1f} ms")
+    print(f"speedup:    {mpl_cold / native_cold:6.1f}x")
+    print(f"mismatched pixels in the axes: {plot_mismatch:.2%} (tolerance {config.plot_tolerance:.1%})")
+    print(f"mismatched pixels in the frame: {mismatch:.2%} (tolerance {config.tolerance:.1%})")
+
+    if plot_mismatch > config.plot_tolerance or mismatch > config.tolerance:
+        raise SystemExit("Native chart differs too much from matplotlib output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares converting the hourly matplotlib figure to PIL through a PNG file with
+wrapping the Agg buffer
+
+Usage:
+    python benchmarks/figure.py [--runs 20]
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+from PIL import Image
+from rpi_weather_display.batch import replay_provider
+from rpi_weather_display.image import (
+    convert_plt_fig_to_pil,
+    convert_plt_fig_to_pil_png,
+    create_hourly_plot,
+)
+
+
+fixture = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fixtures", "tomorrow_timelines.json"
+)
+
+
+def paste(img):
+    """
+    Pastes like create_forecast_image does, which is where the PNG is decoded
+    """
+    frame = Image.new("L", (1448, 1072), color=255)
+    frame.paste(img, (0, 500))
+    return frame
+
+
+def bench(convert, fig, runs: int):
+    start = time.perf_counter()
+    for _ in range(runs):
+        paste(convert(fig))
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", default=20, type=int)
+    config = parser.parse_args()
+
+    with open(fixture, encoding="utf-8") as f:
+        snapshot = replay_provider("tomorrow", json.load(f)).get_snapshot()
+    fig = create_hourly_plot(snapshot)
+
+    expected = np.asarray(paste(convert_plt_fig_to_pil_png(fig)))
+    if not np.array_equal(np.asarray(paste(convert_plt_fig_to_pil(fig))), expected):
+        raise SystemExit("Agg buffer conversion differs from the PNG path")
+
+    png = bench(convert_plt_fig_to_pil_png, fig, config.runs)
+    buffer = bench(convert_plt_fig_to_pil, fig, config.runs)
+
+    print(f"PNG round trip:      {png * 1000:8.2f} ms")
+    print(f"Agg buffer:          {buffer * 1000:8.2f} ms")
+    print(f"speedup:             {png / buffer:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares per-frame PNG decoding of icons with slicing the pre-flattened atlas
+
+Usage:
+    python benchmarks/icons.py [--frames 100] [--color 255]
+"""
+
+import argparse
+import tempfile
+import time
+from rpi_weather_display.assets import icon_path, iconAtlas, load_b_and_white_icon
+
+
+# The 7 daily icons plus the current one, as drawn on every refresh
+FRAME_ICONS = ["01d", "02d", "03d", "04d", "09d", "10d", "13d", "10n"]
+
+
+def bench_png(frames: int, color: int):
+    start = time.perf_counter()
+    for _ in range(frames):
+        for name in FRAME_ICONS:
+            load_b_and_white_icon("{0}/{1}@2x.png".format(icon_path, name), color)
+    return time.perf_counter() - start
+
+
+def bench_atlas(frames: int, color: int, atlas: iconAtlas):
+    start = time.perf_counter()
+    for _ in range(frames):
+        for name in FRAME_ICONS:
+            atlas.get(name)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", default=100, type=int)
+    parser.add_argument("--color", default=255, type=int)
+    config = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        iconAtlas(config.color, cache_dir=cache_dir)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        atlas = iconAtlas(config.color, cache_dir=cache_dir)
+        load = time.perf_counter() - start
+
+        png = bench_png(config.frames, config.color)
+        sliced = bench_atlas(config.frames, config.color, atlas)
+
+        for name in FRAME_ICONS:
+            expected = load_b_and_white_icon(
+                "{0}/{1}@2x.png".format(icon_path, name), config.color
+            )
+            if atlas.get(name).tobytes() != expected.tobytes():
+                raise SystemExit(f"Atlas icon {name} differs from the PNG path")
+
+    per_frame = 1000 / config.frames
+    print(f"atlas build (first use):   {build * 1000:8.2f} ms")
+    print(f"atlas load (mmap cache):   {load * 1000:8.2f} ms")
+    print(f"PNG decode per frame:      {png * per_frame:8.3f} ms")
+    print(f"atlas slice per frame:     {sliced * per_frame:8.3f} ms")
+    print(f"speedup:                   {png / sliced:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Benchmarks provider parsing and every render stage using recorded API responses
+
+Each stage is timed over --runs runs and then run once more under tracemalloc
+to record its peak memory and the number of allocated blocks. Results are
+printed and written as JSON so runs on real Pi hardware can be compared
+across commits.
+
+Usage:
+    python benchmarks/pipeline.py [--runs 5] [--output results.json] [--compare old.json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+from rpi_weather_display import (
+    convert_plt_fig_to_pil,
+    create_current_image,
+    create_daily_image,
+    create_forecast_image,
+    create_hourly_image,
+    create_hourly_plot,
+)
+from rpi_weather_display.batch import replay_provider
+from rpi_weather_display.quantize import pack_4bpp, quantize_image, quantize_levels
+from rpi_weather_display.smoothing import sample_curve
+
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixture(name: str):
+    with open(os.path.join(fixtures_path, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_tomorrow(data: dict):
+    return replay_provider("tomorrow", data).get_snapshot()
+
+
+def parse_owm(data: dict):
+    return replay_provider("openweather", data).get_snapshot()
+
+
+def parse_metno(data: dict):
+    return replay_provider("metno", data).get_snapshot()
+
+
+def measure(func, runs: int):
+    """
+    Returns (result, stats) for func() run `runs` times
+    """
+    times = []
+    for _ in range(runs):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(
+        max(stat.count_diff, 0) for stat in after.compare_to(before, "lineno")
+    )
+
+    return result, {
+        "wall_ms_median": statistics.median(times) * 1000,
+        "wall_ms_min": min(times) * 1000,
+        "peak_kib": peak / 1024,
+        "allocated_blocks": allocated,
+    }
+
+
+def run_benchmarks(runs: int):
+    stages = {}
+
+    tomorrow_data = load_fixture("tomorrow_timelines.json")
+    owm_data = load_fixture("owm_onecall.json")
+    metno_data = load_fixture("metno_compact.json")
+
+    snapshot, stages["parse_tomorrow"] = measure(lambda: parse_tomorrow(tomorrow_data), runs)
+    _, stages["parse_owm"] = measure(lambda: parse_owm(owm_data), runs)
+    _, stages["parse_metno"] = measure(lambda: parse_metno(metno_data), runs)
+
+    current, stages["create_current_image"] = measure(
+        lambda: create_current_image(snapshot.current, snapshot.provider_name), runs
+    )
+    daily, stages["create_daily_image"] = measure(
+        lambda: create_daily_image(snapshot), runs
+    )
+    fig, stages["create_hourly_plot"] = measure(
+        lambda: create_hourly_plot(snapshot), runs
+    )
+    hourly, stages["convert_plt_fig_to_pil"] = measure(
+        lambda: convert_plt_fig_to_pil(fig), runs
+    )
+    _, stages["create_hourly_image_matplotlib"] = measure(
+        lambda: create_hourly_image(snapshot, engine="matplotlib"), runs
+    )
+    _, stages["create_hourly_image_native"] = measure(
+        lambda: create_hourly_image(snapshot, engine="native"), runs
+    )
+    for hours in (48, 120):
+        x = snapshot.hourly_time[0] + np.arange(hours) * 3600.0
+        y = np.resize(snapshot.hourly_temperature, hours)
+        _, stages[f"sample_curve_{hours}h"] = measure(
+            lambda: sample_curve(x, y, 1440), runs
+        )
+    frame, stages["create_forecast_image"] = measure(
+        lambda: create_forecast_image(
+            hourly=hourly, daily=daily, current=current, rotate=180
+        ),
+        runs,
+    )
+    _, stages["quantize_image"] = measure(lambda: quantize_image(frame), runs)
+    _, stages["quantize_image_dither"] = measure(
+        lambda: quantize_image(frame, dither=True), runs
+    )
+    frame_levels = quantize_levels(np.asarray(frame))
+    _, stages["pack_4bpp"] = measure(lambda: pack_4bpp(frame_levels), runs)
+
+    return stages
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(fixtures_path),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(stages: dict, previous: dict = None):
+    print(f"{'stage':<28} {'median ms':>10} {'min ms':>9} {'peak KiB':>10} {'blocks':>8}")
+    for name, s in stages.items():
+        line = (
+            f"{name:<28} {s['wall_ms_median']:10.2f} {s['wall_ms_min']:9.2f} "
+            f"{s['peak_kib']:10.1f} {s['allocated_blocks']:8d}"
+        )
+        if previous and name in previous:
+            change = s["wall_ms_median"] / previous[name]["wall_ms_median"] - 1
+            line += f" {change:+8.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", default=5, type=int)
+    parser.add_argument("--output", help="Write results to this JSON file", type=str)
+    parser.add_argument("--compare", help="Results JSON file to compare against", type=str)
+    config = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "runs": config.runs,
+        "stages": run_benchmarks(config.runs),
+    }
+
+    previous = None
+    if config.compare:
+        with open(config.compare, encoding="utf-8") as f:
+            previous = json.load(f)["stages"]
+
+    print_results(results["stages"], previous)
+
+    if config.output:
+        with open(config.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
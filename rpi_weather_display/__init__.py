@@ -1,10 +1,33 @@
 # -*- coding: utf-8 -*-
 
-from .image import (
-    convert_plt_fig_to_pil,
-    create_hourly_plot,
-    create_forecast_image,
-    create_error_image,
-    create_current_image,
-    create_daily_image,
-)
+import importlib
+
+
+# The render functions pull in PIL, NumPy and matplotlib, so they are only
+# imported the first time one of them is used
+_lazy_names = {
+    "convert_plt_fig_to_pil": ".image",
+    "create_hourly_plot": ".image",
+    "create_hourly_image": ".image",
+    "create_forecast_image": ".image",
+    "create_error_image": ".image",
+    "create_current_image": ".image",
+    "create_daily_image": ".image",
+    "render_forecast_image": ".image",
+    "ForecastSnapshot": ".snapshot",
+}
+
+__all__ = list(_lazy_names)
+
+
+def __getattr__(name):
+    if name in _lazy_names:
+        module = importlib.import_module(_lazy_names[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
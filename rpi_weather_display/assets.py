@@ -0,0 +1,259 @@
+import hashlib
+import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageFont
+
+
+# Set paths for resources. pkg_resources isn't used as importing it scans
+# every installed distribution, which takes seconds on a Pi
+package_path = os.path.dirname(os.path.abspath(__file__))
+font_path = os.path.join(package_path, "fonts", "Roboto-Bold.ttf")
+icon_path = os.path.join(package_path, "icons")
+
+logger = logging.getLogger("assets")
+
+
+def default_cache_dir():
+    """
+    Returns the directory used for on-disk caches
+    """
+    if os.environ.get("RPI_WEATHER_DISPLAY_CACHE_DIR"):
+        return os.environ["RPI_WEATHER_DISPLAY_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "rpi-weather-display")
+
+
+class iconAtlas(object):
+    """
+    All icons pre-flattened onto one background colour in a single "L" image
+
+    The icons are laid out left to right. The atlas is built on first use and
+    written to a raw cache file which later processes mmap instead of decoding
+    the PNGs again. Icons are returned by cropping the atlas.
+    """
+
+    def __init__(self, bg_color: int, path: str = None, cache_dir: str = None):
+        self.bg_color = bg_color
+        self.path = path or icon_path
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+        self.boxes = {}
+        self.image = None
+        self._mmap = None
+        self._build()
+
+    def _icon_files(self):
+        return sorted(f for f in os.listdir(self.path) if f.endswith("@2x.png"))
+
+    def _cache_key(self, files):
+        h = hashlib.sha1(str(self.bg_color).encode())
+        for f in files:
+            st = os.stat(os.path.join(self.path, f))
+            h.update(f"{f}:{st.st_size}:{st.st_mtime_ns}".encode())
+        return h.hexdigest()[:16]
+
+    def _layout(self, files):
+        """
+        Reads only the PNG headers to work out where each icon goes
+        """
+        x = 0
+        height = 0
+        boxes = {}
+        for f in files:
+            with Image.open(os.path.join(self.path, f)) as icon:
+                w, h = icon.size
+            boxes[f[: -len("@2x.png")]] = (x, 0, x + w, h)
+            x += w
+            height = max(height, h)
+        return boxes, (x, height)
+
+    def _build(self):
+        files = self._icon_files()
+        self.boxes, size = self._layout(files)
+
+        raw_file = None
+        if self.cache_dir:
+            raw_file = os.path.join(
+                self.cache_dir, f"icons-{self._cache_key(files)}.raw"
+            )
+            if self._load_raw(raw_file, size):
+                return
+
+        atlas = Image.new("L", size, color=self.bg_color)
+        for name, box in self.boxes.items():
+            atlas.paste(
+                load_b_and_white_icon(
+                    "{0}/{1}@2x.png".format(self.path, name), self.bg_color
+                ),
+                box[:2],
+            )
+        self.image = atlas
+
+        if raw_file:
+            self._save_raw(raw_file)
+
+    def _load_raw(self, raw_file: str, size: tuple):
+        try:
+            with open(raw_file, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        if len(mm) != size[0] * size[1]:
+            mm.close()
+            return False
+
+        self._mmap = mm
+        self.image = Image.frombuffer("L", size, mm, "raw", "L", 0, 1)
+        logger.debug(f"Loaded icon atlas from {raw_file}")
+        return True
+
+    def _save_raw(self, raw_file: str):
+        tmp_file = f"{raw_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_file, "wb") as f:
+                f.write(self.image.tobytes())
+            os.replace(tmp_file, raw_file)
+        except OSError as e:
+            logger.debug(f"Unable to write icon atlas cache {raw_file}: {e}")
+
+    def names(self):
+        """
+        Returns the names of the icons in the atlas
+        """
+        return list(self.boxes)
+
+    def get(self, name: str):
+        """
+        Returns the named icon cropped from the atlas
+        """
+        if name not in self.boxes:
+            raise KeyError(f"Unknown weather icon {name}")
+        return self.image.crop(self.boxes[name])
+
+
+class assetRegistry(object):
+    """
+    A process-wide cache of loaded fonts and icons
+
+    Each (font path, size) pair and each (icon name, background colour) pair is
+    loaded once and kept in a bounded LRU so repeated renders don't re-parse
+    the TTF file or re-decode the icon PNGs.
+    """
+
+    def __init__(self, max_fonts: int = 16, max_icons: int = 64, max_atlases: int = 4):
+        self.max_fonts = max_fonts
+        self.max_icons = max_icons
+        self.max_atlases = max_atlases
+        self.fonts = OrderedDict()
+        self.icons = OrderedDict()
+        self.atlases = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _lookup(self, cache: OrderedDict, key, max_size: int, loader):
+        with self.lock:
+            if key in cache:
+                cache.move_to_end(key)
+                self.hits += 1
+                return cache[key]
+            self.misses += 1
+
+        value = loader()
+
+        with self.lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > max_size:
+                cache.popitem(last=False)
+
+        return value
+
+    def get_font(self, size: int, path: str = None):
+        """
+        Returns a FreeType font of the given size
+        """
+        path = path or font_path
+        return self._lookup(
+            self.fonts,
+            (path, size),
+            self.max_fonts,
+            lambda: ImageFont.truetype(path, size),
+        )
+
+    def get_atlas(self, bg_color: int):
+        """
+        Returns the icon atlas for a background colour
+        """
+        return self._lookup(
+            self.atlases,
+            bg_color,
+            self.max_atlases,
+            lambda: iconAtlas(bg_color),
+        )
+
+    def get_icon(self, name: str, bg_color: int):
+        """
+        Returns a greyscale PIL image of the named icon flattened onto bg_color
+        """
+        return self._lookup(
+            self.icons,
+            (name, bg_color),
+            self.max_icons,
+            lambda: self.get_atlas(bg_color).get(name),
+        )
+
+    def stats(self):
+        """
+        Returns a dict of cache counters
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "fonts": len(self.fonts),
+                "icons": len(self.icons),
+                "atlases": len(self.atlases),
+            }
+
+    def clear(self):
+        """
+        Drops all cached assets and resets the counters
+        """
+        with self.lock:
+            self.fonts.clear()
+            self.icons.clear()
+            self.atlases.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def load_b_and_white_icon(path: str, bg_color: int):
+    """
+    Returns a PIL image of an PNG icon
+    """
+    icon_with_alpha = Image.open(path, mode="r")
+    icon = Image.new("L", icon_with_alpha.size, color=bg_color)
+    icon.paste(icon_with_alpha, (0, 0), mask=icon_with_alpha.split()[3])
+    return icon
+
+
+registry = assetRegistry()
+
+
+def get_font(size: int, path: str = None):
+    """
+    Returns a cached font from the shared registry
+    """
+    return registry.get_font(size, path)
+
+
+def get_icon(name: str, bg_color: int):
+    """
+    Returns a cached icon from the shared registry
+    """
+    return registry.get_icon(name, bg_color)
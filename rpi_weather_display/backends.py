@@ -0,0 +1,129 @@
+import logging
+import os
+from PIL import Image
+
+
+logger = logging.getLogger("backends")
+
+
+class displayBackend(object):
+    """
+    The interface every display backend implements
+
+    paste_image() takes a PIL image that is pasted into the bottom right of
+    a white frame the size of the display, as on the e-ink panel.
+    """
+
+    width = 1448
+    height = 1072
+
+    def clear_display(self):
+        """
+        Clears display by removing any image
+        """
+        pass
+
+    def paste_image(self, img):
+        """
+        Pastes a PIL image to the display
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases anything held by the backend
+        """
+        pass
+
+    def compose_frame(self, img):
+        """
+        Returns img pasted into a full size white "L" frame
+        """
+        if img.size == (self.width, self.height) and img.mode == "L":
+            return img
+        frame = Image.new("L", (self.width, self.height), color=0xFF)
+        frame.paste(img, (self.width - img.size[0], self.height - img.size[1]))
+        return frame
+
+
+class nullDisplay(displayBackend):
+    """
+    Keeps the last frame in memory, for profiling and tests
+    """
+
+    def __init__(self, width: int = 1448, height: int = 1072):
+        self.width = width
+        self.height = height
+        self.frames = 0
+        self.last_frame = None
+
+    def clear_display(self):
+        self.last_frame = None
+
+    def paste_image(self, img):
+        self.last_frame = self.compose_frame(img)
+        self.frames += 1
+
+
+class fileDisplay(displayBackend):
+    """
+    Writes every frame to a file instead of a panel
+
+    Files ending in .raw get the 8-bit greyscale pixels with no header,
+    .4bpp files get the frame quantized to 16 levels and packed two pixels
+    per byte, and anything else is saved by Pillow in the format of its
+    extension. The path can contain {n} which is replaced by the frame number.
+    """
+
+    def __init__(self, path: str = "frame.png", width: int = 1448, height: int = 1072):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.frames = 0
+
+    def paste_image(self, img):
+        frame = self.compose_frame(img)
+        path = self.path.format(n=self.frames)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+        if ext == ".raw":
+            with open(tmp_path, "wb") as f:
+                f.write(frame.tobytes())
+        elif ext == ".4bpp":
+            from .quantize import pack_image
+
+            with open(tmp_path, "wb") as f:
+                f.write(pack_image(frame).data)
+        else:
+            frame.save(tmp_path)
+        os.replace(tmp_path, path)
+
+        logger.debug(f"Wrote frame to {path}")
+        self.frames += 1
+        return path
+
+
+def create_display(
+        name: str,
+        vcom: float = -2.48,
+        output: str = "frame.png",
+        full_refresh_every: int = 10,
+    ):
+    """
+    Returns a display backend by its command line name: 'it8951' for the
+    e-ink panel, 'file' or 'null'
+    """
+    if name == "it8951":
+        from .display import eInkDisplay
+
+        return eInkDisplay(vcom=vcom, full_refresh_every=full_refresh_every)
+    elif name == "file":
+        return fileDisplay(output)
+    elif name == "null":
+        return nullDisplay()
+    else:
+        raise ValueError(f"Unknown display {name}")
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class replayResponse(object):
+    def __init__(self, data: dict):
+        self.data = data
+        self.status_code = 200
+        self.headers = {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class replaySession(object):
+    """
+    Stands in for requests.Session and always returns a recorded response
+    """
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    def get(self, *args, **kwargs):
+        return replayResponse(self.data)
+
+    def request(self, *args, **kwargs):
+        return replayResponse(self.data)
+
+
+def replay_provider(name: str, data: dict, lat: float = 0, long: float = 0):
+    """
+    Returns a provider that parses a recorded API response instead of
+    calling the API
+    """
+    from .cache import forecastCache
+    from .providers import metNorway, owmWeather, tomorrow
+
+    cache = forecastCache(persist=False)
+
+    if name == "tomorrow":
+        provider = tomorrow(lat, long, "replay", cache=cache)
+        provider.fetcher.session = replaySession(data)
+        return provider
+    elif name == "openweather":
+        provider = owmWeather(lat, long, "replay", cache=cache)
+        provider.fetcher.session = replaySession(data)
+        return provider
+    elif name == "metno":
+        provider = metNorway(lat, long, cache=cache)
+        provider.fetcher.session = replaySession(data)
+        return provider
+    else:
+        raise ValueError(f"Can't replay weather provider {name}")
+
+
+def render_frame(job: dict):
+    """
+    Fetches the forecast for one configuration, renders its frame and writes
+    it to job["output"]. Returns the job with timings added.
+    """
+    from .backends import fileDisplay
+    from .cache import forecastCache
+    from .image import render_forecast_image
+    from .providers import create_provider
+
+    timings = {}
+
+    start = time.perf_counter()
+    if job.get("fixture"):
+        with open(job["fixture"], encoding="utf-8") as f:
+            provider = replay_provider(
+                job["provider"], json.load(f), job["latitude"], job["longitude"]
+            )
+    else:
+        provider = create_provider(
+            job["provider"],
+            lat=job["latitude"],
+            long=job["longitude"],
+            api_key=job.get("api_key"),
+            cache=forecastCache(job.get("cache_file"), persist=bool(job.get("cache_file"))),
+        )
+    snapshot = provider.get_snapshot()
+    timings["fetch_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    img = render_forecast_image(
+        snapshot,
+        time_zone_name=job["time_zone_name"],
+        chart_engine=job["chart_engine"],
+        rotate=job["rotate"],
+    )
+    timings["render_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    fileDisplay(job["output"]).paste_image(img)
+    timings["write_ms"] = (time.perf_counter() - start) * 1000
+
+    return dict(job, pid=os.getpid(), **timings)
+
+
+def _render_job(job: dict):
+    """
+    Returns render_frame(job), or the job with an "error" if it failed so
+    one bad configuration doesn't stop the rest of the batch
+    """
+    try:
+        return render_frame(job)
+    except Exception as e:
+        return dict(job, pid=os.getpid(), error=f"{type(e).__name__}: {e}")
+
+
+def render_batch(jobs: list, processes: int = None):
+    """
+    Renders many configurations in a process pool and returns the results in
+    the same order as jobs. Jobs that failed have an "error" instead of
+    timings.
+    """
+    if processes == 1:
+        return [_render_job(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_render_job, jobs))
+
+
+def load_jobs(path: str, defaults: dict, output_dir: str, extension: str):
+    """
+    Reads a JSON list of configurations, each with at least a latitude and
+    longitude, and fills in defaults and the output file. Raises ValueError
+    for a configuration with an unsupported rotation.
+    """
+    from .layout import orientations
+
+    with open(path, encoding="utf-8") as f:
+        configs = json.load(f)
+
+    jobs = []
+    for i, config in enumerate(configs):
+        job = dict(defaults, **config)
+        job.setdefault("name", f"{i:04d}-{job['latitude']}-{job['longitude']}")
+        if job["rotate"] not in orientations:
+            raise ValueError(
+                f"Configuration {job['name']} has rotate {job['rotate']!r}, use "
+                + " or ".join(str(r) for r in orientations)
+            )
+        job["output"] = os.path.join(output_dir, f"{job['name']}.{extension}")
+        jobs.append(job)
+    return jobs
+
+
+def main():
+    from .layout import orientations
+
+    parser = argparse.ArgumentParser(
+        description="Renders weather display frames for many locations in parallel"
+    )
+    parser.add_argument(
+        "configs",
+        help="JSON file with a list of configurations, e.g. "
+        '[{"name": "berlin", "latitude": 52.5, "longitude": 13.4}]. '
+        "Any option below can be overridden per configuration.",
+        type=str,
+    )
+    parser.add_argument("-O", "--output-dir", help="Directory for the frames", default="frames")
+    parser.add_argument(
+        "--format", help="Frame file format, e.g. 'png' or 'raw'", default="png", type=str
+    )
+    parser.add_argument(
+        "-j", "--processes", help="Number of worker processes, defaults to CPU count", type=int
+    )
+    parser.add_argument("-p", "--provider", help="Weather provider", default="tomorrow")
+    parser.add_argument("-k", "--api-key", help="Weather provider API key", type=str)
+    parser.add_argument(
+        "--fixture",
+        help="Recorded provider response to render instead of calling the API",
+        type=str,
+    )
+    parser.add_argument("-t", "--time-zone-name", help="Time zone name.", default="Europe/Berlin")
+    parser.add_argument(
+        "-c",
+        "--chart-engine",
+        help="Engine used to draw the hourly plots",
+        default="matplotlib",
+        choices=["matplotlib", "native"],
+    )
+    parser.add_argument(
+        "--rotate", help="Rotation of the frames", default=180, type=int, choices=list(orientations)
+    )
+    parser.add_argument("--report", help="Write per frame timings to this JSON file", type=str)
+
+    config = parser.parse_args()
+
+    defaults = {
+        "provider": config.provider,
+        "api_key": config.api_key,
+        "fixture": config.fixture,
+        "time_zone_name": config.time_zone_name,
+        "chart_engine": config.chart_engine,
+        "rotate": config.rotate,
+    }
+    try:
+        jobs = load_jobs(config.configs, defaults, config.output_dir, config.format)
+    except ValueError as e:
+        parser.error(str(e))
+    if not jobs:
+        print("No configurations to render")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    results = render_batch(jobs, processes=config.processes)
+    elapsed = time.perf_counter() - start
+
+    failed = [r for r in results if "error" in r]
+    for r in results:
+        if "error" in r:
+            print(f"{r['name']:<30} failed: {r['error']}")
+            continue
+        print(
+            f"{r['name']:<30} fetch {r['fetch_ms']:8.1f}ms  render {r['render_ms']:8.1f}ms  "
+            f"write {r['write_ms']:7.1f}ms  {r['output']}"
+        )
+    rendered = len(results) - len(failed)
+    print(f"Rendered {rendered} frames in {elapsed:.2f}s ({rendered / elapsed:.2f} frames/s)")
+
+    if config.report:
+        with open(config.report, "w", encoding="utf-8") as f:
+            json.dump(
+                [{k: v for k, v in r.items() if k != "api_key"} for r in results],
+                f,
+                indent=2,
+            )
+
+    if failed:
+        print(f"{len(failed)} of {len(results)} frames failed")
+        sys.exit(1)
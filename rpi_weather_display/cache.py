@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import threading
+import time
+from .assets import default_cache_dir
+
+
+logger = logging.getLogger("forecastCache")
+
+
+class forecastCache(object):
+    """
+    A small on-disk cache of raw provider responses that survives restarts
+
+    Entries are keyed by provider, location and timestep and expire after
+    their TTL. For `stale_ttl` seconds after that an expired entry can still
+    be returned while a background thread refetches it (stale-while-revalidate).
+    The cache file is rewritten atomically so a crash can't corrupt it.
+    """
+
+    def __init__(self, path: str = None, persist: bool = True, max_entries: int = 64):
+        self.path = path or os.path.join(default_cache_dir(), "forecast.json")
+        self.persist = persist
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.refreshing = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.entries = self._load()
+
+    @staticmethod
+    def key(provider: str, lat: float, long: float, timestep: str):
+        """
+        Returns the cache key for a forecast
+        """
+        return f"{provider}:{round(lat, 4)},{round(long, 4)}:{timestep}"
+
+    def _load(self):
+        if not self.persist:
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable forecast cache {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        if not self.persist:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Unable to write forecast cache {self.path}: {e}")
+
+    def _prune(self, now: float):
+        """
+        Drops entries that are past their stale window, then the oldest
+        entries if there are too many
+        """
+        for key, entry in list(self.entries.items()):
+            if now - entry["stored_at"] > entry["ttl"] + entry["stale_ttl"]:
+                del self.entries[key]
+        if len(self.entries) > self.max_entries:
+            oldest = sorted(self.entries, key=lambda k: self.entries[k]["stored_at"])
+            for key in oldest[: len(self.entries) - self.max_entries]:
+                del self.entries[key]
+
+    def get(self, key: str):
+        """
+        Returns (value, age in seconds) for a key, or (None, None) if missing
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, None
+            return entry["value"], time.time() - entry["stored_at"]
+
+    def set(self, key: str, value, ttl: float, stale_ttl: float = 0):
+        """
+        Stores a JSON serialisable value and writes the cache file, and
+        returns the time it was stored at
+        """
+        now = time.time()
+        with self.lock:
+            self.entries[key] = {
+                "value": value,
+                "stored_at": now,
+                "ttl": ttl,
+                "stale_ttl": stale_ttl,
+            }
+            self._prune(now)
+            self._save()
+        return now
+
+    def _revalidate(self, key: str, fetch, ttl: float, stale_ttl: float, ttl_from=None):
+        """
+        Starts refetching key in a background thread unless that is already
+        happening, and returns the thread
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return self.refreshing[key]
+
+            def refresh():
+                try:
+                    value = fetch()
+                    self.set(key, value, ttl_from(value) if ttl_from else ttl, stale_ttl)
+                    logger.debug(f"Revalidated {key}")
+                except Exception as e:
+                    logger.warning(f"Background refresh of {key} failed: {e}")
+                finally:
+                    with self.lock:
+                        self.refreshing.pop(key, None)
+
+            thread = threading.Thread(target=refresh, name=f"revalidate {key}", daemon=True)
+            self.refreshing[key] = thread
+            thread.start()
+            return thread
+
+    def fetch(
+            self,
+            key: str,
+            fetch,
+            ttl: float,
+            stale_ttl: float = 0,
+            wait: float = 0,
+            ttl_from=None,
+        ):
+        """
+        Returns the cached value for key, calling fetch() to get it if it is
+        missing or expired
+
+        If the value is stale, fetch() runs in the background and is given
+        `wait` seconds to finish. If it takes longer the stale value is
+        returned and the fresh one will be used by a later call.
+
+        `ttl_from(value)` can give each fetched value its own TTL, e.g. from
+        the response's Expires header, in which case `ttl` only applies to
+        entries stored without one.
+        """
+        return self.fetch_entry(key, fetch, ttl, stale_ttl, wait, ttl_from)[0]
+
+    def fetch_entry(
+            self,
+            key: str,
+            fetch,
+            ttl: float,
+            stale_ttl: float = 0,
+            wait: float = 0,
+            ttl_from=None,
+        ):
+        """
+        Like fetch() but returns (value, stored_at, expired), so callers can
+        tell how old the value is and whether it is past its TTL
+        """
+        def entry_ttl(entry):
+            return entry["ttl"] if ttl_from else ttl
+
+        with self.lock:
+            entry = self.entries.get(key)
+            age = time.time() - entry["stored_at"] if entry else None
+
+            if entry and age < entry_ttl(entry):
+                self.hits += 1
+                return entry["value"], entry["stored_at"], False
+
+            if entry and age < entry_ttl(entry) + stale_ttl:
+                self.stale_hits += 1
+                stale_entry = entry
+            else:
+                self.misses += 1
+                stale_entry = None
+
+        if stale_entry is not None:
+            self._revalidate(key, fetch, ttl, stale_ttl, ttl_from).join(wait)
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry and time.time() - entry["stored_at"] < entry_ttl(entry):
+                return entry["value"], entry["stored_at"], False
+            logger.debug(f"Serving stale {key} ({age:.0f}s old) while revalidating")
+            return stale_entry["value"], stale_entry["stored_at"], True
+
+        value = fetch()
+        stored_at = self.set(key, value, ttl_from(value) if ttl_from else ttl, stale_ttl)
+        return value, stored_at, False
+
+    def stats(self):
+        """
+        Returns a dict of cache counters
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+            }
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    Returns the process-wide forecast cache stored in the default cache directory
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = forecastCache()
+    return _default_cache
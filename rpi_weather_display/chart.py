@@ -0,0 +1,227 @@
+import numpy as np
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from PIL import Image, ImageDraw
+from .assets import get_font
+from .smoothing import smooth
+from .snapshot import as_snapshot
+
+
+# Geometry of the matplotlib figure created by create_hourly_plot
+# (20x7.7 inches at 72 DPI after tight_layout)
+width = 1440
+height = 554
+plot_left = 90
+plot_right = 1429.2
+panel_boxes = {
+    "temperature": (13.2, 235.8),
+    "rain": (283.6, 506.2),
+}
+
+line_width = 10
+grid_color = 0x99
+grid_width = 5
+grid_dash = (18.5, 8)
+spine_width = 3
+tick_length = 4
+tick_pad = 4
+font_size = 30
+
+x_tick_hours = [1, 2, 3, 4, 6, 12, 24]
+y_tick_steps = [1, 2, 2.5, 5, 10]
+
+
+def nice_ticks(low: float, high: float, max_ticks: int = 3):
+    """
+    Returns evenly spaced round tick values within [low, high]
+    """
+    span = high - low
+    if span <= 0:
+        return np.array([low])
+
+    raw_step = span / max_ticks
+    scale = 10 ** np.floor(np.log10(raw_step))
+    step = next(s * scale for s in y_tick_steps if s * scale >= raw_step)
+    ticks = np.arange(np.ceil(low / step) * step, high + step * 1e-9, step)
+    return np.round(ticks, 10)
+
+
+def time_ticks(start: float, end: float, tz, max_ticks: int = 9):
+    """
+    Returns epoch times of whole local hours to label on the x axis
+    """
+    span_hours = (end - start) / 3600
+    interval = next(
+        (i for i in x_tick_hours if span_hours / i <= max_ticks), x_tick_hours[-1]
+    )
+    # Quarter hours so that local whole hours in zones like Asia/Kolkata,
+    # which are offset from UTC by a fraction of an hour, are candidates too
+    candidates = np.arange(np.floor(start / 900) * 900, end + 1, 900)
+    ticks = []
+    for t in candidates:
+        local = datetime.fromtimestamp(t, tz)
+        if t >= start and local.minute == 0 and local.hour % interval == 0:
+            ticks.append(t)
+    return np.array(ticks)
+
+
+def format_tick(value: float):
+    """
+    Formats a y axis tick like matplotlib's ScalarFormatter
+    """
+    if float(value).is_integer():
+        text = str(int(value))
+    else:
+        text = f"{value:g}"
+    return text.replace("-", "−")
+
+
+def _dashed_segments(start: float, end: float):
+    """
+    Returns (N, 2) array of dash start/end offsets between start and end
+    """
+    period = grid_dash[0] + grid_dash[1]
+    starts = np.arange(start, end, period)
+    ends = np.minimum(starts + grid_dash[0], end)
+    return np.stack([starts, ends], axis=1)
+
+
+class hourlyChart(object):
+    """
+    Draws the hourly temperature and rain panels straight into an "L" image
+
+    A faster alternative to the matplotlib figure built by create_hourly_plot,
+    using the same geometry so the two outputs line up.
+    """
+
+    def __init__(self, color: int = 255, time_zone_name: str = "Europe/Berlin"):
+        self.color = color
+        self.tz = ZoneInfo(time_zone_name)
+        self.font = get_font(font_size)
+
+    def _x_to_px(self, x: np.ndarray, x_min: float, x_max: float):
+        return plot_left + (x - x_min) / (x_max - x_min) * (plot_right - plot_left)
+
+    def _y_to_px(self, y: np.ndarray, box: tuple, y_min: float, y_max: float):
+        top, bottom = box
+        return bottom - (y - y_min) / (y_max - y_min) * (bottom - top)
+
+    def _draw_grid(self, d, box, x_ticks_px, y_ticks_px):
+        top, bottom = box
+        half = grid_width // 2
+        # matplotlib starts the dashes of vertical grid lines at the bottom
+        for x in x_ticks_px:
+            for y0, y1 in _dashed_segments(0, bottom - top):
+                d.rectangle((x - half, bottom - y1, x + half, bottom - y0), fill=grid_color)
+        for y in y_ticks_px:
+            for x0, x1 in _dashed_segments(plot_left, plot_right):
+                d.rectangle((x0, y - half, x1, y + half), fill=grid_color)
+
+    def _draw_axes(self, img, d, box, x_ticks_px, x_labels, y_ticks_px, y_labels, label):
+        top, bottom = box
+        bottom = np.floor(bottom + 0.5)
+
+        # Spines
+        d.rectangle(
+            (plot_left - spine_width // 2, top, plot_left + spine_width // 2, bottom),
+            fill=0,
+        )
+        d.rectangle(
+            (plot_left, bottom - spine_width // 2, plot_right, bottom + spine_width // 2),
+            fill=0,
+        )
+
+        # X ticks and labels
+        for x, text in zip(x_ticks_px, x_labels):
+            d.line((x, bottom, x, bottom + tick_length), fill=0)
+            d.text(
+                (x, bottom + tick_length + tick_pad),
+                text,
+                font=self.font,
+                fill=0,
+                anchor="mt",
+            )
+
+        # Y ticks and labels
+        for y, text in zip(y_ticks_px, y_labels):
+            d.line((plot_left - tick_length, y, plot_left, y), fill=0)
+            d.text(
+                (plot_left - tick_length - tick_pad, y),
+                text,
+                font=self.font,
+                fill=0,
+                anchor="rm",
+            )
+
+        # Rotated axis label
+        left, _, right, _ = d.textbbox((0, 0), label, font=self.font, anchor="lt")
+        label_img = Image.new("L", (right - left, font_size + 8), color=self.color)
+        ImageDraw.Draw(label_img).text(
+            (0, 0), label, font=self.font, fill=0, anchor="lt"
+        )
+        label_img = label_img.transpose(Image.Transpose.ROTATE_90)
+        img.paste(
+            label_img,
+            (10, int((top + bottom) / 2 - label_img.size[1] / 2)),
+        )
+
+    def _draw_panel(self, img, d, box, x, y, x_lim, y_lim, label):
+        # Ticks cover the margins as well, like matplotlib's date locator
+        x_ticks = time_ticks(*x_lim, self.tz)
+        # Odd width lines are snapped to pixel centres like matplotlib does
+        x_ticks_px = np.floor(self._x_to_px(x_ticks, *x_lim) + 0.5)
+        x_labels = [datetime.fromtimestamp(t, self.tz).strftime("%H:%M") for t in x_ticks]
+
+        y_ticks = nice_ticks(*y_lim)
+        y_ticks_px = np.floor(self._y_to_px(y_ticks, box, *y_lim) + 0.5)
+        y_labels = [format_tick(v) for v in y_ticks]
+
+        self._draw_grid(d, box, x_ticks_px, y_ticks_px)
+
+        # Sample the curve once per pixel column, the monotone spline never
+        # overshoots so rain stays at 0 between dry hours
+        px_start, px_end = self._x_to_px(np.array([x[0], x[-1]]), *x_lim)
+        px = np.arange(np.floor(px_start), np.ceil(px_end) + 1)
+        x_samples = x_lim[0] + (px - plot_left) / (plot_right - plot_left) * (
+            x_lim[1] - x_lim[0]
+        )
+        x_samples = np.clip(x_samples, x[0], x[-1])
+        y_samples = smooth(x, y, x_samples)
+        py = self._y_to_px(y_samples, box, *y_lim)
+
+        d.line(list(zip(px.tolist(), py.tolist())), fill=0, width=line_width, joint="curve")
+
+        self._draw_axes(img, d, box, x_ticks_px, x_labels, y_ticks_px, y_labels, label)
+
+    def render(self, data):
+        """
+        Returns an "L" PIL image of the hourly temperature and rain plots from
+        a ForecastSnapshot or a list of hourly data
+        """
+        data = as_snapshot(data)
+        x = data.hourly_time.astype(np.float64)
+        temperature = data.hourly_temperature
+        rain = data.hourly_rain
+
+        # Same limits as matplotlib: 5% margins, rain axis fixed at the bottom
+        x_margin = (x[-1] - x[0]) * 0.05
+        x_lim = (x[0] - x_margin, x[-1] + x_margin)
+        t_margin = max(temperature.max() - temperature.min(), 1) * 0.05
+        t_lim = (temperature.min() - t_margin, temperature.max() + t_margin)
+        r_lim = (-0.1, rain.max() + 1)
+
+        img = Image.new("L", (width, height), color=self.color)
+        d = ImageDraw.Draw(img)
+        self._draw_panel(img, d, panel_boxes["temperature"], x, temperature, x_lim, t_lim, "Celcius")
+        self._draw_panel(img, d, panel_boxes["rain"], x, rain, x_lim, r_lim, "Millimeter")
+
+        return img
+
+
+def create_hourly_chart_image(
+        data, color: int = 255, time_zone_name: str = "Europe/Berlin"
+    ):
+    """
+    Creates the hourly temperature and rain plots without matplotlib
+    """
+    return hourlyChart(color=color, time_zone_name=time_zone_name).render(data)
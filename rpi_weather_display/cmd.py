@@ -3,18 +3,20 @@
 
 import argparse
 import sys
-import time
-import traceback
-from rpi_weather_display import (
-    create_hourly_plot,
-    create_forecast_image,
-    create_error_image,
-    create_current_image,
-    create_daily_image,
-    convert_plt_fig_to_pil,
-)
-from rpi_weather_display.providers import owmWeather, tomorrow
-from rpi_weather_display.display import eInkDisplay
+
+
+# Modules that are lazily imported by each code path, used by --profile-startup
+startup_modules = {
+    "common": ["rpi_weather_display.image"],
+    "it8951": ["rpi_weather_display.display"],
+    "matplotlib": ["matplotlib.figure", "matplotlib.backends.backend_agg"],
+    "native": ["rpi_weather_display.chart"],
+    "tomorrow": ["rpi_weather_display.providers.tomorrow"],
+    "openweather": ["rpi_weather_display.providers.owm"],
+    "metno": ["rpi_weather_display.providers.metno"],
+    "hedged": ["rpi_weather_display.providers.hedged"],
+    "server": ["rpi_weather_display.server"],
+}
 
 
 def main():
@@ -37,6 +39,30 @@ def main():
     parser.add_argument(
         "-v", "--vcom", help="E-ink display VCOM value", default=-2.48, type=float
     )
+    parser.add_argument(
+        "-d",
+        "--display",
+        help="Where to show the forecast: 'it8951' for the e-ink display, "
+        "'file' to write each frame to --output or 'null' to discard it.",
+        default="it8951",
+        choices=["it8951", "file", "null"],
+        type=str,
+    )
+    parser.add_argument(
+        "--output",
+        help="File written by the 'file' display. Ending it in .raw writes "
+        "raw 8-bit pixels and {n} is replaced by the frame number.",
+        default="frame.png",
+        type=str,
+    )
+    parser.add_argument(
+        "-f",
+        "--full-refresh-every",
+        help="Do a full flashing refresh every N display updates to clear ghosting, "
+        "only changed regions are refreshed in between. 1 always does full refreshes.",
+        default=10,
+        type=int,
+    )
     parser.add_argument(
         "-r",
         "--refresh",
@@ -44,64 +70,268 @@ def main():
         default=15,
         type=int,
     )
+    parser.add_argument(
+        "--error-retry",
+        help="Minutes to wait before fetching again after an error",
+        default=5,
+        type=float,
+    )
+    parser.add_argument(
+        "--max-stale",
+        help="When fetching fails, keep showing the last forecast marked as stale "
+        "for up to this many hours before showing the error. 0 shows errors straight away.",
+        default=24,
+        type=float,
+    )
     parser.add_argument(
         "-p",
         "--provider",
-        help="Weather provider. Can be 'tomorrow' or 'openweather'.",
+        help="Weather provider. Can be 'tomorrow', 'openweather' or 'metno', or a "
+        "comma separated list of them to fall back on when one is slow or failing.",
         default="tomorrow",
         type=str,
     )
+    parser.add_argument(
+        "--hedge-after",
+        help="With several providers, seconds to wait for the best one before "
+        "also asking the next",
+        default=2.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-c",
+        "--chart-engine",
+        help="Engine used to draw the hourly plots. Can be 'matplotlib' or 'native'.",
+        default="matplotlib",
+        choices=["matplotlib", "native"],
+        type=str,
+    )
     parser.add_argument(
         "-k",
         "--api-key",
-        help="Weather provider API key",
+        help="Weather provider API key, required unless --server or the metno provider "
+        "is used. With several providers, a comma separated list with one key per provider.",
+        type=str,
+    )
+    parser.add_argument(
+        "--dither",
+        help="Use ordered dithering when reducing the frame to the panel's 16 grey levels",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-s",
+        "--server",
+        help="Get ready to display frames from a rpi-weather-display-server at this URL, "
+        "e.g. http://weather.local:8080, instead of fetching and rendering locally",
+        default=None,
+        type=str,
+    )
+
+    parser.add_argument(
+        "--connect-timeout",
+        help="Seconds to wait for a connection to the weather provider",
+        default=5,
+        type=float,
+    )
+    parser.add_argument(
+        "--read-timeout",
+        help="Seconds to wait for a response from the weather provider",
+        default=30,
+        type=float,
+    )
+    parser.add_argument(
+        "--cache-file",
+        help="File used to cache forecasts between restarts. "
+        "Defaults to ~/.cache/rpi-weather-display/forecast.json",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Write Prometheus metrics to this file after every update, "
+        "e.g. for the node_exporter textfile collector",
+        default=None,
         type=str,
-        required=True
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--memory-profile",
+        help="Trace allocations and log RSS, gc counts and the allocation sites "
+        "that grew after every update",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--memory-threshold",
+        help="With --memory-profile, write a report to --memory-report every "
+        "time RSS grows by this many MB since the first update",
+        default=50,
+        type=float,
+    )
+    parser.add_argument(
+        "--memory-report",
+        help="File for the --memory-profile report",
+        default="memory-report.txt",
+        type=str,
+    )
+    parser.add_argument(
+        "--profile-startup",
+        help="Report the import cost of each module used with the given options and exit",
+        action="store_true",
     )
 
     config = parser.parse_args()
 
-    if config.provider == "tomorrow":
-        forecast = tomorrow(
-            lat=config.latitude, long=config.longitude, api_key=config.api_key
+    if not config.server:
+        from rpi_weather_display.providers import split_providers
+
+        try:
+            provider_names = [name for name, _ in split_providers(config.provider, config.api_key)]
+        except ValueError as e:
+            parser.error(str(e))
+
+    if config.profile_startup:
+        from rpi_weather_display.profiling import profile_imports, format_import_profile
+
+        if config.server:
+            modules = startup_modules["common"] + startup_modules["server"]
+        else:
+            modules = startup_modules["common"] + startup_modules[config.chart_engine]
+            for name in provider_names:
+                modules += startup_modules.get(name, [])
+            if len(provider_names) > 1:
+                modules += startup_modules["hedged"]
+        modules += startup_modules.get(config.display, [])
+        print(format_import_profile(*profile_imports(modules)))
+        sys.exit(0)
+
+    memory_profiler = None
+    if config.memory_profile:
+        from rpi_weather_display.profiling import memoryProfiler
+
+        memory_profiler = memoryProfiler(
+            threshold_mb=config.memory_threshold, report_path=config.memory_report
         )
-    elif config.provider == "openweather":
-        forecast = owmWeather(
-            lat=config.latitude, long=config.longitude, api_key=config.api_key
+
+    from rpi_weather_display import create_error_image, render_forecast_image
+    from rpi_weather_display.assets import registry
+    from rpi_weather_display.backends import create_display
+    from rpi_weather_display.cache import forecastCache
+    from rpi_weather_display.metrics import metrics
+    from rpi_weather_display.pipeline import forecastPipeline
+    from rpi_weather_display.providers import create_provider
+    from rpi_weather_display.quantize import quantize_image
+    from rpi_weather_display.text import glyph_cache
+
+    metrics.register_gauge(
+        "asset_cache", registry.stats, label="stat", help="Font and icon cache hits, misses and size"
+    )
+    metrics.register_gauge(
+        "text_cache",
+        glyph_cache.stats,
+        label="stat",
+        help="Text drawn from cached glyphs (fast) or with FreeType (fallback)",
+    )
+    if memory_profiler:
+        metrics.register_gauge(
+            "memory", memory_profiler.stats, label="stat", help="RSS, traced memory and gc collections"
         )
+    if config.metrics_port:
+        metrics.serve(config.metrics_port)
+
+    if config.server:
+        from rpi_weather_display.server import frameClient
+
+        client = frameClient(
+            config.server,
+            lat=config.latitude,
+            long=config.longitude,
+            time_zone_name=config.time_zone_name,
+            chart_engine=config.chart_engine,
+            rotate=180,
+            connect_timeout=config.connect_timeout,
+            read_timeout=config.read_timeout,
+        )
+        fetch = client.get_frame
+
+        def render(img):
+            return img
+
     else:
-        print(f"Unknown weather provider {config.provider}")
-        sys.exit(1)
+        cache = forecastCache(config.cache_file)
+        metrics.register_gauge(
+            "forecast_cache", cache.stats, label="stat", help="Forecast cache hits, misses and size"
+        )
 
-    display = eInkDisplay(vcom=config.vcom)
+        try:
+            forecast = create_provider(
+                config.provider,
+                lat=config.latitude,
+                long=config.longitude,
+                api_key=config.api_key,
+                cache=cache,
+                connect_timeout=config.connect_timeout,
+                read_timeout=config.read_timeout,
+                hedge_after=config.hedge_after,
+                max_stale=config.max_stale * 3600,
+            )
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        if len(provider_names) > 1:
+            metrics.register_gauge(
+                "providers",
+                forecast.stats,
+                label="stat",
+                help="Latency, error rate, wins and hedges of each weather provider",
+            )
+        fetch = forecast.get_snapshot
 
-    try:
-        while True:
-            try:
-                c_image = create_current_image(forecast.get_current_weather(), forecast.provider_name)
-                d_image = create_daily_image(forecast.get_daily_data())
-                h_plot = create_hourly_plot(
-                    forecast.get_hourly_data(), time_zone_name=config.time_zone_name
-                )
-
-                img = create_forecast_image(
-                    hourly=convert_plt_fig_to_pil(h_plot),
-                    daily=d_image,
-                    current=c_image,
-                    rotate=180,
-                )
-
-                display.paste_image(img)
-
-            except Exception:
-                error_img = create_error_image(error_text=traceback.format_exc(), rotate=180)
-                display.paste_image(error_img)
-                time.sleep(300)
-                continue
-
-            print("Forecast and display successfully updated")
-            time.sleep(config.refresh * 60)
+        def render(snapshot):
+            img = render_forecast_image(
+                snapshot,
+                time_zone_name=config.time_zone_name,
+                chart_engine=config.chart_engine,
+                rotate=180,
+            )
+            with metrics.time("render_seconds", panel="quantize"):
+                return quantize_image(img, dither=config.dither)
+
+    display = create_display(
+        config.display,
+        vcom=config.vcom,
+        output=config.output,
+        full_refresh_every=config.full_refresh_every,
+    )
+
+    def paste_image(img):
+        try:
+            display.paste_image(img)
+        finally:
+            if memory_profiler:
+                memory_profiler.sample()
+                print(memory_profiler.format_sample())
+            if config.metrics_file:
+                metrics.write_textfile(config.metrics_file)
 
+    def render_error(error_text):
+        return create_error_image(error_text=error_text, rotate=180)
+
+    pipeline = forecastPipeline(
+        fetch=fetch,
+        render=render,
+        display=paste_image,
+        render_error=render_error,
+        refresh=config.refresh * 60,
+        error_retry=config.error_retry * 60,
+    )
+
+    try:
+        pipeline.run()
     except KeyboardInterrupt:
         print("Exiting")
         sys.exit(0)
@@ -1,15 +1,79 @@
+import logging
+import numpy as np
 from IT8951.display import AutoEPDDisplay
 from IT8951 import constants
+from .backends import displayBackend
 
 
-class eInkDisplay(object):
+logger = logging.getLogger("eInkDisplay")
+
+
+def changed_regions(
+        previous: np.ndarray,
+        current: np.ndarray,
+        row_gap: int = 16,
+        align: int = 4,
+        max_regions: int = 8,
+    ):
+    """
+    Returns a list of (left, top, right, bottom) boxes covering every pixel
+    that differs between two frames
+
+    Changed rows are grouped into horizontal bands, merging bands separated
+    by fewer than row_gap unchanged rows, and each band is narrowed to its
+    changed columns. Horizontal edges are aligned to `align` pixels because
+    the controller packs pixels 4 bits at a time. If there are more than
+    max_regions bands they are merged into a single box.
+    """
+    diff = previous != current
+    rows = np.flatnonzero(diff.any(axis=1))
+    if rows.size == 0:
+        return []
+
+    # Split the changed rows wherever there is a big enough unchanged gap
+    breaks = np.flatnonzero(np.diff(rows) > row_gap)
+    band_starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    band_ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+
+    if len(band_starts) > max_regions:
+        band_starts = band_starts[:1]
+        band_ends = band_ends[-1:]
+
+    height, width = current.shape
+    boxes = []
+    for top, bottom in zip(band_starts, band_ends):
+        cols = np.flatnonzero(diff[top:bottom].any(axis=0))
+        left = int(cols[0]) // align * align
+        right = min(width, -(-(int(cols[-1]) + 1) // align) * align)
+        boxes.append((left, int(top), right, int(bottom)))
+
+    return boxes
+
+
+class eInkDisplay(displayBackend):
     """
     An object to manage the Waveshare e-ink display
+
+    The last frame sent to the panel is kept so that later frames only
+    update the regions that changed, using a fast non-flashing waveform.
+    A full GC16 refresh is forced every `full_refresh_every` updates to clear
+    ghosting. Set it to 1 to always do full refreshes.
     """
 
-    def __init__(self, vcom: float):
+    def __init__(
+            self,
+            vcom: float,
+            full_refresh_every: int = 10,
+            partial_mode: int = None,
+        ):
         self.display = AutoEPDDisplay(vcom=vcom)
+        self.full_refresh_every = full_refresh_every
+        self.partial_mode = partial_mode
+        self.last_frame = None
+        self.partial_updates = 0
         self.clear_display()
+        self.width = self.display.width
+        self.height = self.display.height
         self.dims = (self.display.width, self.display.height)
 
     def clear_display(self):
@@ -17,6 +81,40 @@ class eInkDisplay(object):
         Clears display by removing any image
         """
         self.display.clear()
+        self.last_frame = None
+
+    def _partial_mode_for(self, region: np.ndarray):
+        """
+        Picks a waveform for a region: DU if it is pure black and white,
+        otherwise GL16 which handles grey levels without flashing
+        """
+        if self.partial_mode is not None:
+            return self.partial_mode
+        if np.all((region == 0x00) | (region == 0xFF)):
+            return constants.DisplayModes.DU
+        return constants.DisplayModes.GL16
+
+    def draw_full(self, frame: np.ndarray):
+        """
+        Sends the whole frame buffer with a flashing GC16 refresh
+        """
+        self.display.draw_full(constants.DisplayModes.GC16)
+        self.last_frame = frame
+        self.partial_updates = 0
+
+    def draw_regions(self, frame: np.ndarray, boxes: list):
+        """
+        Sends only the given regions of the frame buffer to the panel
+        """
+        for box in boxes:
+            left, top, right, bottom = box
+            mode = self._partial_mode_for(frame[top:bottom, left:right])
+            region = self.display.frame_buf.crop(box)
+            logger.debug(f"Partial update of {box} with mode {mode}")
+            self.display.update(region.tobytes(), (left, top), region.size, mode)
+
+        self.last_frame = frame
+        self.partial_updates += 1
 
     def paste_image(self, img):
         """
@@ -27,4 +125,18 @@ class eInkDisplay(object):
         )
         paste_coords = [self.dims[i] - img.size[i] for i in (0, 1)]
         self.display.frame_buf.paste(img, paste_coords)
-        self.display.draw_full(constants.DisplayModes.GC16)
+        frame = np.asarray(self.display.frame_buf)
+
+        if (
+            self.last_frame is None
+            or self.partial_updates + 1 >= self.full_refresh_every
+        ):
+            self.draw_full(frame)
+            return
+
+        boxes = changed_regions(self.last_frame, frame)
+        if not boxes:
+            logger.debug("Frame unchanged, skipping display update")
+            return
+
+        self.draw_regions(frame, boxes)
@@ -0,0 +1,184 @@
+import logging
+import math
+import random
+import threading
+import time
+import requests
+from .metrics import metrics
+
+
+logger = logging.getLogger("fetch")
+
+
+class circuitOpenError(Exception):
+    """
+    Raised instead of making a request while a provider's circuit is open
+    """
+
+
+class circuitBreaker(object):
+    """
+    Stops calling an upstream that keeps failing
+
+    After `failure_threshold` failed requests in a row the circuit opens
+    and requests fail immediately for `reset_after` seconds. Then one trial
+    request is let through (half open): if it succeeds the circuit closes,
+    otherwise it opens again.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_after: float = 300):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """
+        Returns True if a request may be made now
+        """
+        with self.lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def retry_in(self):
+        """
+        Returns the seconds until the next trial request is allowed
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(0, self.opened_at + self.reset_after - time.monotonic())
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class httpFetcher(object):
+    """
+    GET requests to a weather API with timeouts, retries and a circuit breaker
+
+    Every attempt has connect and read timeouts, and all attempts together
+    have to fit in `deadline` seconds. Connection errors, timeouts, 429 and
+    5xx responses are retried up to `retries` times after an exponential
+    backoff with full jitter, or after the server's Retry-After. Any other
+    response is returned to the caller to handle. Requests run over one
+    persistent session so the TLS connection is reused between refreshes.
+    """
+
+    retry_statuses = (429, 500, 502, 503, 504)
+    retry_errors = (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+
+    def __init__(
+            self,
+            provider: str,
+            connect_timeout: float = 5,
+            read_timeout: float = 30,
+            deadline: float = 60,
+            retries: int = 2,
+            backoff: float = 1,
+            max_backoff: float = 30,
+            breaker: circuitBreaker = None,
+        ):
+        self.provider = provider
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker if breaker is not None else circuitBreaker()
+        self.session = requests.Session()
+
+    def _retry_after(self, response):
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def _delay(self, attempt: int):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, url: str, params: dict = None, headers: dict = None):
+        """
+        Returns the response, or raises the last error once the retries or
+        the deadline are used up, or circuitOpenError if the circuit is open
+        """
+        if not self.breaker.allow():
+            metrics.inc("provider_circuit_open_total", provider=self.provider)
+            retry_in = self.breaker.retry_in()
+            if retry_in > 0:
+                raise circuitOpenError(
+                    f"{self.provider} failed repeatedly, not retrying for another {math.ceil(retry_in)}s"
+                )
+            # Half open with the one trial request still running
+            raise circuitOpenError(
+                f"{self.provider} failed repeatedly, a trial request is in progress"
+            )
+
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = max(deadline - time.monotonic(), 0.1)
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            retry_after = None
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+                if response.status_code not in self.retry_statuses:
+                    self.breaker.record_success()
+                    return response
+                error = requests.HTTPError(
+                    f"{response.status_code} response from {self.provider}", response=response
+                )
+                retry_after = self._retry_after(response)
+            except self.retry_errors as e:
+                error = e
+            except Exception:
+                # Not worth retrying, but it must still end a half open trial
+                self.breaker.record_failure()
+                raise
+
+            delay = retry_after if retry_after is not None else self._delay(attempt)
+            attempt += 1
+            if attempt > self.retries or time.monotonic() + delay >= deadline:
+                self.breaker.record_failure()
+                raise error
+
+            metrics.inc("provider_retries_total", provider=self.provider)
+            logger.warning(
+                f"Request to {self.provider} failed ({error}), retry {attempt} of "
+                f"{self.retries} in {delay:.1f}s"
+            )
+            time.sleep(delay)
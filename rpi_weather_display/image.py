@@ -1,18 +1,59 @@
-import pandas as pd
-import matplotlib.pyplot as plt
 import io
-from PIL import Image, ImageDraw, ImageFont
-from pkg_resources import resource_filename
-from datetime import datetime
-from matplotlib.dates import DateFormatter
-
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+import numpy as np
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from .assets import get_font, get_icon
+from .metrics import metrics
+from .smoothing import sample_curve
+from .snapshot import as_snapshot
+from .text import draw_text
+
+
+class panelCache(object):
+    """
+    Keeps recently rendered panels keyed by a fingerprint of their inputs
 
-# Set DPI
-plt.rcParams["figure.dpi"] = 72
+    A panel is only redrawn when the data it shows changes, so a cycle
+    where the forecast is the same as last time only redraws the "Last
+    updated" time.
+    """
 
-# Set paths for resources
-font_path = resource_filename("rpi_weather_display", "fonts/Roboto-Bold.ttf")
-icon_path = resource_filename("rpi_weather_display", "icons")
+    def __init__(self, max_size: int = 8):
+        self.max_size = max_size
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, panel: str, key: tuple, render):
+        """
+        Returns the cached image for (panel, key) or calls render() to make
+        it. The returned image is shared and must not be modified.
+        """
+        key = (panel,) + key
+        with self.lock:
+            img = self.images.get(key)
+            if img is not None:
+                self.images.move_to_end(key)
+        if img is not None:
+            metrics.inc("panel_cache_total", panel=panel, result="hit")
+            return img
+
+        metrics.inc("panel_cache_total", panel=panel, result="miss")
+        img = render()
+        with self.lock:
+            self.images[key] = img
+            while len(self.images) > self.max_size:
+                self.images.popitem(last=False)
+        return img
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+
+
+panel_cache = panelCache()
 
 
 def create_forecast_image(
@@ -40,7 +81,27 @@ def create_forecast_image(
 
 def convert_plt_fig_to_pil(fig):
     """
-    Converts a matplotlib.pyplot figure to a PIL image
+    Converts a matplotlib.pyplot figure to an "L" PIL image
+
+    The figure is drawn once with Agg and its RGBA buffer is wrapped without
+    copying, so the only copy is the conversion to greyscale.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    canvas = fig.canvas
+    if not isinstance(canvas, FigureCanvasAgg):
+        canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    buf = canvas.buffer_rgba()
+    height, width = buf.shape[:2]
+    img = Image.frombuffer("RGBA", (width, height), buf, "raw", "RGBA", 0, 1)
+    return img.convert("L")
+
+
+def convert_plt_fig_to_pil_png(fig):
+    """
+    Converts a matplotlib.pyplot figure to a PIL image through a PNG file,
+    kept for comparison with convert_plt_fig_to_pil
     """
     buf = io.BytesIO()
     fig.savefig(buf)
@@ -49,16 +110,6 @@ def convert_plt_fig_to_pil(fig):
     return img
 
 
-def get_b_and_white_icon(path: str, gb_color: int):
-    """
-    Returns a PIL image of an PNG icon
-    """
-    icon_with_alpha = Image.open(path, mode="r")
-    icon = Image.new("L", icon_with_alpha.size, color=gb_color)
-    icon.paste(icon_with_alpha, (0, 0), mask=icon_with_alpha.split()[3])
-    return icon
-
-
 def create_error_image(
         error_text: str,
         width: int = 1448,
@@ -72,57 +123,66 @@ def create_error_image(
     img = Image.new("L", (width, height), color=color)
     d = ImageDraw.Draw(img)
     time_now = datetime.now().strftime("%Y-%m-%d %H:%M")
-    d.text((10, 10), f"{time_now}\n{error_text}", font=ImageFont.truetype(font_path, 30), fill=0)
+    d.text((10, 10), f"{time_now}\n{error_text}", font=get_font(30), fill=0)
 
     return img.rotate(rotate)
 
 
-def create_daily_image(daily_data: list, color: int = 255):
+def create_daily_image(daily_data, color: int = 255, header: bool = True):
     """
-    Creates the image for the daily weather
+    Creates the image for the daily weather from a ForecastSnapshot or a list
+    of daily data. header=False leaves out the static header for layouts
+    that draw it separately.
     """
+    daily_data = as_snapshot(daily_data)
     width = 1448
     height = 320
     left_indent = 20
     top_indent = 20
 
     img = Image.new("L", (width, height), color=color)
-    d = ImageDraw.Draw(img)
-
-    d.text(
-        (left_indent, top_indent),
-        "W e a t h e r   FUTURE",
-        font=ImageFont.truetype(font_path, 40),
-        fill=0,
-    )
+    if header:
+        draw_text(
+            img,
+            (left_indent, top_indent),
+            "W e a t h e r   FUTURE",
+            font=get_font(40),
+            fill=0,
+        )
 
+    today = datetime.today().date()
     indent = left_indent
-    for day in daily_data:
-        d = ImageDraw.Draw(img)
+    for day_time, t_max, t_min, rain, icon_name in zip(
+        daily_data.daily_time.tolist(),
+        daily_data.daily_temperature_max.tolist(),
+        daily_data.daily_temperature_min.tolist(),
+        daily_data.daily_rain.tolist(),
+        daily_data.daily_icon.tolist(),
+    ):
+        day_time = datetime.fromtimestamp(day_time, timezone.utc).replace(tzinfo=None)
 
-        if day["time"].date() == datetime.today().date():
+        if day_time.date() == today:
             day_name = "Today"
         else:
-            day_name = day["time"].strftime("%A")
+            day_name = day_time.strftime("%A")
 
         text_lines = [
             day_name,
-            str(round(day["temperature_max"]))
+            str(round(t_max))
             + "° / "
-            + str(round(day["temperature_min"]))
+            + str(round(t_min))
             + "°",
-            "Rain " + str(round(day["rain"], 1)) + "mm",
+            "Rain " + str(round(rain, 1)) + "mm",
         ]
 
-        icon = get_b_and_white_icon(
-            "{0}/{1}@2x.png".format(icon_path, day["weather_icon_name"]), color
-        )
+        icon = get_icon(icon_name, color)
         img.paste(icon, (indent - 10, 173))
 
-        d.text(
+        draw_text(
+            img,
             (indent, 80),
             "\n".join(text_lines),
-            font=ImageFont.truetype(font_path, 30),
+            font=get_font(30),
             fill=0,
         )
 
@@ -131,15 +191,15 @@ def create_daily_image(daily_data: list, color: int = 255):
     return img
 
 
-def create_current_image(current: dict, provider_name: str, color: int = 255):
+def create_current_panel(current: dict, color: int = 255, header: bool = True):
     """
-    Creates the image for the current weather
+    Creates the image for the current weather without the update time.
+    header=False also leaves out the static header.
     """
     width = 1448
     height = 220
     left_indent = 20
     top_indent = 20
-    update_time = datetime.now().strftime("%H:%M")
 
     img = Image.new("L", (width, height), color=color)
 
@@ -150,30 +210,43 @@ def create_current_image(current: dict, provider_name: str, color: int = 255):
     ]
     text = "\n".join(text_lines)
 
-    d = ImageDraw.Draw(img)
-    d.text(
-        (left_indent, top_indent),
-        "W e a t h e r   NOW",
-        font=ImageFont.truetype(font_path, 40),
-        fill=0,
-    )
-    d.text((left_indent, 80), text, font=ImageFont.truetype(font_path, 30), fill=0)
+    if header:
+        draw_text(
+            img,
+            (left_indent, top_indent),
+            "W e a t h e r   NOW",
+            font=get_font(40),
+            fill=0,
+        )
+    draw_text(img, (left_indent, 80), text, font=get_font(30), fill=0)
 
-    icon = get_b_and_white_icon(
-        "{0}/{1}@2x.png".format(icon_path, current["weather_icon_name"]), color
-    )
+    icon = get_icon(current["weather_icon_name"], color)
     img.paste(icon, (400, 50))
-    d.text(
+    draw_text(
+        img,
         (560, 100),
         current["description"],
-        font=ImageFont.truetype(font_path, 50),
+        font=get_font(50),
         fill=0,
     )
 
-    d.text(
+    return img
+
+
+def draw_update_time(
+        img: Image, provider_name: str, update_time: str = None, stale: bool = False
+    ):
+    """
+    Draws the update time and provider name into the current weather image,
+    for stale data update_time is when it was fetched
+    """
+    update_time = update_time or datetime.now().strftime("%H:%M")
+    label = "Stale data from" if stale else "Last updated"
+    draw_text(
+        img,
         (1190, 18),
-        f"Last updated {update_time} \nProvider: {provider_name}",
-        font=ImageFont.truetype(font_path, 20),
+        f"{label} {update_time} \nProvider: {provider_name}",
+        font=get_font(20),
         align='right',
         fill=0,
     )
@@ -181,53 +254,260 @@ def create_current_image(current: dict, provider_name: str, color: int = 255):
     return img
 
 
+def create_current_image(current: dict, provider_name: str, color: int = 255):
+    """
+    Creates the image for the current weather
+    """
+    return draw_update_time(create_current_panel(current, color=color), provider_name)
+
+
+class hourlyPlot(object):
+    """
+    The matplotlib hourly temperature and rain plots, built once and redrawn
+    with new data
+
+    The figure isn't created through pyplot, so nothing keeps it alive
+    after the object is gone. Each render only updates the line data and
+    axis limits. If the limits are the same as last time the cached
+    background of grid, ticks and labels is restored and only the lines
+    are drawn on top, otherwise the whole figure is laid out and drawn
+    again.
+    """
+
+    def __init__(self, color: int = 255, time_zone_name: str = "Europe/Berlin", blit: bool = True):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.color = color
+        self.time_zone_name = time_zone_name
+        # Fails on an unknown time zone before the figure is created
+        self.tz = ZoneInfo(time_zone_name)
+        self.blit = blit
+        self.lines = None
+        self.background = None
+        self.background_key = None
+        self.lock = threading.Lock()
+
+        facecolor = (color / 255,) * 3
+        self.figure = Figure(figsize=(20, 7.7), dpi=72, facecolor=facecolor)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax_temperature = self.figure.add_subplot(211)
+        self.ax_rain = self.figure.add_subplot(212)
+        self.samples = int(self.figure.bbox.width)
+        self.subplot_params = {
+            k: getattr(self.figure.subplotpars, k)
+            for k in ("left", "bottom", "right", "top", "wspace", "hspace")
+        }
+
+        for ax, label in [(self.ax_temperature, "Celcius"), (self.ax_rain, "Millimeter")]:
+            ax.set_facecolor(facecolor)
+            ax.tick_params(labelsize=30)
+            ax.grid(color="#999999", linestyle="--", linewidth=5)
+            ax.set_ylabel(label, fontsize=30)
+            for axis in ["bottom", "left"]:
+                ax.spines[axis].set_linewidth(3)
+            for axis in ["top", "right"]:
+                ax.spines[axis].set_linewidth(0)
+
+    def _frame(self, data):
+        """
+        Returns the times as datetime64 and the temperature and rain sampled
+        once per pixel column of the figure along a monotone spline, so the
+        lines are smooth without resampling to one row per minute
+        """
+        x, temperature = sample_curve(data.hourly_time, data.hourly_temperature, self.samples)
+        _, rain = sample_curve(data.hourly_time, data.hourly_rain, self.samples)
+        times = np.round(x * 1e6).astype("datetime64[us]")
+        return times, temperature, rain
+
+    def update(self, data):
+        """
+        Sets the plotted data from a ForecastSnapshot or a list of hourly data
+        """
+        from matplotlib.dates import AutoDateLocator, DateFormatter
+
+        data = as_snapshot(data)
+        times, temperature, rain = self._frame(data)
+
+        if self.lines is None:
+            # The first plot sets up the date units of the x axes, ticks are
+            # placed and labelled in local time
+            self.lines = [
+                ax.plot(times, values, color="black", linewidth=10, animated=self.blit)[0]
+                for ax, values in [(self.ax_temperature, temperature), (self.ax_rain, rain)]
+            ]
+            for ax in (self.ax_temperature, self.ax_rain):
+                ax.xaxis.set_major_locator(AutoDateLocator(tz=self.tz))
+                ax.xaxis.set_major_formatter(DateFormatter("%H:%M", tz=self.tz))
+        else:
+            self.lines[0].set_data(times, temperature)
+            self.lines[1].set_data(times, rain)
+            for ax in (self.ax_temperature, self.ax_rain):
+                ax.relim()
+            self.ax_temperature.autoscale_view()
+            self.ax_rain.autoscale_view(scaley=False)
+
+        self.ax_rain.set_ylim(bottom=-0.1, top=data.hourly_rain.max() + 1)
+
+    def _limits(self):
+        return tuple(
+            ax.get_xlim() + ax.get_ylim() for ax in (self.ax_temperature, self.ax_rain)
+        )
+
+    def draw(self):
+        """
+        Draws the figure, only redrawing the lines if the axes are unchanged
+        """
+        key = self._limits()
+        if not self.blit or key != self.background_key:
+            self.figure.subplots_adjust(**self.subplot_params)
+            self.figure.tight_layout()
+            self.canvas.draw()
+            if self.blit:
+                self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+                self.background_key = key
+        else:
+            self.canvas.restore_region(self.background)
+
+        if self.blit:
+            for ax, line in zip((self.ax_temperature, self.ax_rain), self.lines):
+                ax.draw_artist(line)
+
+    def render(self, data):
+        """
+        Returns the plots for the data as an "L" PIL image
+        """
+        with self.lock:
+            self.update(data)
+            self.draw()
+            buf = self.canvas.buffer_rgba()
+            height, width = buf.shape[:2]
+            img = Image.frombuffer("RGBA", (width, height), buf, "raw", "RGBA", 0, 1)
+            return img.convert("L")
+
+
+# Each plot keeps a matplotlib figure, so only the most recently used are kept
+_hourly_plots = OrderedDict()
+_hourly_plots_lock = threading.Lock()
+max_hourly_plots = 8
+
+
+def get_hourly_plot(color: int = 255, time_zone_name: str = "Europe/Berlin"):
+    """
+    Returns the shared hourlyPlot for a background colour and time zone
+    """
+    key = (color, time_zone_name)
+    with _hourly_plots_lock:
+        plot = _hourly_plots.get(key)
+        if plot is None:
+            plot = hourlyPlot(color, time_zone_name)
+            _hourly_plots[key] = plot
+            while len(_hourly_plots) > max_hourly_plots:
+                _hourly_plots.popitem(last=False)
+        else:
+            _hourly_plots.move_to_end(key)
+        return plot
+
+
 def create_hourly_plot(
-        data: list, color: int = 255, time_zone_name: str = "Europe/Berlin"
+        data, color: int = 255, time_zone_name: str = "Europe/Berlin"
+    ):
+    """
+    Creates the hourly temperature and rain plots from a ForecastSnapshot or
+    a list of hourly data and returns the matplotlib figure
+    """
+    plot = hourlyPlot(color, time_zone_name, blit=False)
+    plot.update(data)
+    plot.figure.tight_layout()
+    return plot.figure
+
+
+def create_hourly_image(
+        data,
+        color: int = 255,
+        time_zone_name: str = "Europe/Berlin",
+        engine: str = "matplotlib",
+    ):
+    """
+    Creates the hourly plots as a PIL image from a ForecastSnapshot or a
+    list of hourly data using the chosen chart engine, either 'matplotlib'
+    or 'native'
+    """
+    if engine == "matplotlib":
+        return get_hourly_plot(color, time_zone_name).render(data)
+    elif engine == "native":
+        from .chart import create_hourly_chart_image
+
+        return create_hourly_chart_image(
+            data, color=color, time_zone_name=time_zone_name
+        )
+    else:
+        raise ValueError(f"Unknown chart engine {engine}")
+
+
+def render_forecast_image(
+        snapshot,
+        time_zone_name: str = "Europe/Berlin",
+        chart_engine: str = "matplotlib",
+        rotate: int = 0,
+        color: int = 255,
+        cache: panelCache = panel_cache,
+        layout=None,
     ):
     """
-    Creates the hourly temperature and rain plots
-    """
-    y_top = max([d["rain"] for d in data]) + 1
-    df = pd.DataFrame(data)
-    df["time"] = pd.to_datetime(df["time"], utc=True)
-    df["time"] = df["time"].dt.tz_convert(time_zone_name)
-    df.set_index("time", inplace=True, drop=True)
-
-    # Set colours and font sizes
-    plt.rc("xtick", labelsize=30)  # fontsize of the tick labels
-    plt.rc("ytick", labelsize=30)  # fontsize of the tick labels
-    plt.rc("axes", labelsize=30)  # fontsize of the x and y labels
-    plt.rc("figure", facecolor=(color / 255,) * 3)
-    plt.rc("axes", facecolor=(color / 255,) * 3)
-
-    # Resample and interpolate the DataFrame to make lines smooth
-    df = df.resample("1T").asfreq()
-    df = df.interpolate(method="cubic")
-    df.loc[df.rain < 0, "rain"] = 0
-
-    # Create the plot
-    fig = plt.figure(figsize=(20, 7.7), facecolor=(color / 255,) * 3)
-    ax2 = plt.subplot(211)
-    plt.plot(df.index, df["temperature"], color="black", linewidth=10)
-    plt.grid(color="#999999", linestyle="--", linewidth=5)
-    plt.ylabel("Celcius")
-    ax1 = plt.subplot(212)
-    ax1.set_ylim(bottom=-0.1, top=y_top)
-    plt.plot(df.index, df["rain"], color="black", linewidth=10)
-    plt.grid(color="#999999", linestyle="--", linewidth=5)
-    plt.ylabel("Millimeter")
-    date_form = DateFormatter("%H:%M", tz=df.index.tz)
-    ax1.xaxis.set_major_formatter(date_form)
-    ax2.xaxis.set_major_formatter(date_form)
-
-    for axis in ["bottom", "left"]:
-        ax1.spines[axis].set_linewidth(3)
-        ax2.spines[axis].set_linewidth(3)
-
-    for axis in ["top", "right"]:
-        ax1.spines[axis].set_linewidth(0)
-        ax2.spines[axis].set_linewidth(0)
-
-    fig.tight_layout()
-
-    return fig
+    Renders all panels for a ForecastSnapshot and combines them into the
+    image to send to the display
+
+    Panels whose data has the same fingerprint as a previous render are
+    reused from `cache`, pass None to always redraw them. The panels are
+    composed by a layoutEngine, by default the shared forecast layout, which
+    draws the static headers.
+    """
+    from .layout import default_layout
+
+    layout = layout or default_layout
+    if cache is None:
+        cache = panelCache(max_size=0)
+
+    with metrics.time("render_seconds", panel="hourly"):
+        h_image = cache.get(
+            "hourly",
+            (chart_engine, time_zone_name, color, snapshot.fingerprint(*snapshot.hourly_fields)),
+            lambda: create_hourly_image(
+                snapshot,
+                color=color,
+                time_zone_name=time_zone_name,
+                engine=chart_engine,
+            ),
+        )
+    with metrics.time("render_seconds", panel="daily"):
+        # The first day is labelled "Today" so the panel also depends on the date
+        d_image = cache.get(
+            "daily",
+            (color, datetime.today().date(), snapshot.fingerprint(*snapshot.daily_fields)),
+            lambda: create_daily_image(snapshot, color=color, header=False),
+        )
+    with metrics.time("render_seconds", panel="current"):
+        c_image = cache.get(
+            "current",
+            (color, snapshot.fingerprint("current")),
+            lambda: create_current_panel(snapshot.current, color=color, header=False),
+        )
+        # Both labels use the display's time zone so the time doesn't jump
+        # when the data goes stale
+        tz = ZoneInfo(time_zone_name)
+        now = datetime.now(tz)
+        update_time = now.strftime("%H:%M")
+        if snapshot.stale:
+            fetched = datetime.fromtimestamp(snapshot.fetched_at, tz)
+            same_day = fetched.date() == now.date()
+            update_time = fetched.strftime("%H:%M" if same_day else "%a %H:%M")
+        c_image = draw_update_time(
+            c_image.copy(), snapshot.provider_name, update_time, stale=snapshot.stale
+        )
+    with metrics.time("render_seconds", panel="compose"):
+        return layout.compose(
+            {"current": c_image, "daily": d_image, "hourly": h_image},
+            rotate=rotate,
+            color=color,
+        )
@@ -0,0 +1,160 @@
+import threading
+from PIL import Image, ImageChops, ImageDraw
+from .assets import get_font
+
+
+# Lossless transposes for the supported display orientations. The layout is
+# landscape like the panel, so a frame turned by 90 or 270 degrees wouldn't
+# fit the panel and those need a portrait layout first.
+orientations = {
+    0: None,
+    180: Image.ROTATE_180,
+}
+
+
+class layoutRegion(object):
+    """
+    A rectangle of the frame filled by one panel
+
+    Panels are clipped to `size`, so a panel taller than its region doesn't
+    spill into the next one. `static_text` is a list of (xy, text, font
+    size) drawn once into the static layer instead of into every panel.
+    """
+
+    def __init__(self, name: str, position: tuple, size: tuple, static_text: list = ()):
+        self.name = name
+        self.position = position
+        self.size = size
+        self.static_text = static_text
+
+    @property
+    def box(self):
+        return (
+            self.position[0],
+            self.position[1],
+            self.position[0] + self.size[0],
+            self.position[1] + self.size[1],
+        )
+
+
+# The panels as create_forecast_image pastes them, each clipped where the
+# next one starts
+forecast_layout = [
+    layoutRegion(
+        "current",
+        (0, 0),
+        (1448, 180),
+        static_text=[((20, 20), "W e a t h e r   NOW", 40)],
+    ),
+    layoutRegion(
+        "daily",
+        (0, 180),
+        (1448, 320),
+        static_text=[((20, 20), "W e a t h e r   FUTURE", 40)],
+    ),
+    layoutRegion("hourly", (0, 500), (1448, 572)),
+]
+
+
+class layoutEngine(object):
+    """
+    Composes panel images into display frames following a list of regions
+
+    For every orientation and background colour the static layer is drawn
+    once, and the last frame is kept along with the panels it was made of.
+    A panel that is the same object as last time, e.g. from the panel
+    cache, is skipped, and changed panels are transposed on their own
+    straight into the target orientation rather than rotating the whole
+    frame.
+    """
+
+    def __init__(self, regions: list = None, width: int = 1448, height: int = 1072):
+        self.regions = regions if regions is not None else forecast_layout
+        self.width = width
+        self.height = height
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def _target_box(self, region: layoutRegion, rotate: int):
+        """
+        Returns where a region ends up in the frame after rotating it
+        """
+        left, top, right, bottom = region.box
+        w, h = self.width, self.height
+        if rotate == 180:
+            return (w - right, h - bottom, w - left, h - top)
+        return (left, top, right, bottom)
+
+    def _static_layer(self, region: layoutRegion, rotate: int, color: int):
+        """
+        Returns the static text of a region drawn in the target orientation,
+        or None if it has none
+        """
+        if not region.static_text:
+            return None
+        layer = Image.new("L", region.size, color=color)
+        d = ImageDraw.Draw(layer)
+        for xy, text, size in region.static_text:
+            d.text(xy, text, font=get_font(size), fill=0)
+        if orientations[rotate] is not None:
+            layer = layer.transpose(orientations[rotate])
+        return layer
+
+    def _state(self, rotate: int, color: int):
+        key = (rotate, color)
+        if key not in self.states:
+            self.states[key] = {
+                "frame": Image.new("L", (self.width, self.height), color=color),
+                "static": {
+                    r.name: self._static_layer(r, rotate, color) for r in self.regions
+                },
+                "panels": {},
+            }
+        return self.states[key]
+
+    def _fit(self, img: Image, region: layoutRegion, color: int):
+        """
+        Returns an "L" image the size of the region, clipping or padding the
+        panel with the background colour
+        """
+        if img.mode != "L":
+            img = img.convert("L")
+        if img.size != region.size:
+            canvas = Image.new("L", region.size, color=color)
+            canvas.paste(img, (0, 0))
+            img = canvas
+        return img
+
+    def compose(self, panels: dict, rotate: int = 0, color: int = 255):
+        """
+        Returns a frame made of the panel images keyed by region name,
+        rotated by 0 or 180 degrees
+        """
+        if rotate not in orientations:
+            raise ValueError(f"Unsupported rotation {rotate}, use 0 or 180")
+
+        with self.lock:
+            state = self._state(rotate, color)
+            frame = state["frame"]
+            for region in self.regions:
+                img = panels.get(region.name)
+                if img is None or state["panels"].get(region.name) is img:
+                    continue
+
+                layer = self._fit(img, region, color)
+                if orientations[rotate] is not None:
+                    layer = layer.transpose(orientations[rotate])
+                static = state["static"][region.name]
+                if static is not None:
+                    layer = ImageChops.darker(layer, static)
+                frame.paste(layer, self._target_box(region, rotate))
+                state["panels"][region.name] = img
+
+            return frame.copy()
+
+    def clear(self):
+        with self.lock:
+            self.states.clear()
+
+
+default_layout = layoutEngine()
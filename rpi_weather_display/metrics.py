@@ -0,0 +1,208 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger("metrics")
+
+prefix = "rpi_weather_display_"
+
+# Bucket upper bounds in seconds, from a fast render to a slow e-ink refresh
+default_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels: tuple, extra: dict = None):
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class rollingHistogram(object):
+    """
+    A histogram with cumulative Prometheus buckets, plus the most recent
+    `window` samples so quantiles reflect current behaviour
+    """
+
+    def __init__(self, buckets: tuple = default_buckets, window: int = 100):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantile(self, q: float):
+        """
+        Returns the q quantile of the recent samples, or None if there are none
+        """
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class metricsRegistry(object):
+    """
+    Collects stage timings, counters and gauges and exports them in the
+    Prometheus text format, either to a textfile for node_exporter or over a
+    small local HTTP endpoint
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.help = {}
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Adds a sample to a histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = rollingHistogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """
+        Times the wrapped block in seconds and adds it to a histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increments a counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_gauge(self, name: str, func, label: str = None, help: str = ""):
+        """
+        Registers a function called on export. It returns a number, or a dict
+        of numbers which are exported with their keys as the `label` label.
+        """
+        with self.lock:
+            self.gauges[name] = (func, label)
+            if help:
+                self.help[name] = help
+
+    def to_prometheus(self):
+        """
+        Returns all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+            seen = set()
+            for (name, labels), hist in histograms:
+                full_name = prefix + name
+                if name not in seen:
+                    lines.append(f"# TYPE {full_name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{full_name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}"
+                    )
+                lines.append(
+                    f"{full_name}_bucket{_format_labels(labels, {'le': '+Inf'})} {hist.count}"
+                )
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {hist.sum}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {hist.count}")
+                for q in (0.5, 0.9, 0.99):
+                    value = hist.quantile(q)
+                    if value is not None:
+                        lines.append(
+                            f"{full_name}_recent{_format_labels(labels, {'quantile': q})} {value}"
+                        )
+
+            seen = set()
+            for (name, labels), value in counters:
+                full_name = prefix + name
+                if name not in seen:
+                    lines.append(f"# TYPE {full_name} counter")
+                    seen.add(name)
+                lines.append(f"{full_name}{_format_labels(labels)} {value}")
+
+        for name, (func, label) in gauges:
+            full_name = prefix + name
+            try:
+                value = func()
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {e}")
+                continue
+            if name in self.help:
+                lines.append(f"# HELP {full_name} {self.help[name]}")
+            lines.append(f"# TYPE {full_name} gauge")
+            if isinstance(value, dict):
+                for key, v in sorted(value.items()):
+                    lines.append(f"{full_name}{_format_labels((), {label: key})} {v}")
+            else:
+                lines.append(f"{full_name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """
+        Atomically writes the metrics to a file for node_exporter's textfile
+        collector
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Unable to write metrics to {path}: {e}")
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serves the metrics on http://host:port/metrics in a background thread
+        and returns the server
+        """
+        registry = self
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+metrics = metricsRegistry()
@@ -0,0 +1,175 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+from .metrics import metrics
+
+
+logger = logging.getLogger("pipeline")
+
+
+class wallClockScheduler(object):
+    """
+    Schedules ticks on multiples of `period` seconds of the wall clock
+
+    A slow cycle doesn't push back the following ones: the next tick is
+    always the next multiple of the period, e.g. :00, :15, :30 and :45 past
+    the hour for a 15 minute period.
+    """
+
+    def __init__(self, period: float, offset: float = 0):
+        self.period = period
+        self.offset = offset
+
+    def next_tick(self, now: float = None):
+        """
+        Returns the wall clock time of the next tick after now
+        """
+        now = time.time() if now is None else now
+        ticks = (now - self.offset) // self.period + 1
+        return ticks * self.period + self.offset
+
+    def wait(self, stop: threading.Event, until: float = None):
+        """
+        Sleeps until the next tick, or `until`, or until stop is set.
+        Returns False if stopped.
+        """
+        until = self.next_tick() if until is None else until
+        return not stop.wait(max(0, until - time.time()))
+
+
+class forecastPipeline(object):
+    """
+    Runs the fetch, render and display stages concurrently
+
+    Each stage runs in its own thread and hands its output to the next one
+    through a bounded queue, so fetching the next forecast and rendering can
+    overlap with the slow e-ink refresh. The display stage runs in the
+    calling thread.
+
+    fetch() returns the forecast data, render(data) returns an image,
+    display(image) shows it and render_error(text) returns an image for an
+    exception traceback.
+    """
+
+    def __init__(
+            self,
+            fetch,
+            render,
+            display,
+            render_error,
+            refresh: float,
+            error_retry: float = 300,
+            queue_size: int = 1,
+        ):
+        self.fetch = fetch
+        self.render = render
+        self.display = display
+        self.render_error = render_error
+        self.scheduler = wallClockScheduler(refresh)
+        self.error_retry = error_retry
+        self.render_queue = queue.Queue(maxsize=queue_size)
+        self.display_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def _put(self, q: queue.Queue, item):
+        """
+        Blocks until there is room in the queue or the pipeline is stopped
+        """
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _fetch_stage(self):
+        while not self.stop_event.is_set():
+            try:
+                with metrics.time("stage_seconds", stage="fetch"):
+                    item = ("forecast", self.fetch())
+                retry_at = None
+            except Exception:
+                metrics.inc("errors_total", stage="fetch")
+                item = ("error", traceback.format_exc())
+                retry_at = time.time() + self.error_retry
+
+            if not self._put(self.render_queue, item):
+                return
+            if not self.scheduler.wait(self.stop_event, until=retry_at):
+                return
+
+    def _render_stage(self):
+        while not self.stop_event.is_set():
+            item = self._get(self.render_queue)
+            if item is None:
+                return
+
+            kind, payload = item
+            try:
+                if kind == "forecast":
+                    with metrics.time("stage_seconds", stage="render"):
+                        img = ("forecast", self.render(payload))
+                else:
+                    img = ("error", self.render_error(payload))
+            except Exception:
+                metrics.inc("errors_total", stage="render")
+                img = ("error", self.render_error(traceback.format_exc()))
+
+            if not self._put(self.display_queue, img):
+                return
+
+    def start(self):
+        """
+        Starts the fetch and render stage threads
+        """
+        for name, target in [("fetch", self._fetch_stage), ("render", self._render_stage)]:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Stops all stages
+        """
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def run(self):
+        """
+        Starts the pipeline and runs the display stage until stopped
+        """
+        self.start()
+        try:
+            while not self.stop_event.is_set():
+                item = self._get(self.display_queue)
+                if item is None:
+                    return
+
+                kind, img = item
+                try:
+                    with metrics.time("stage_seconds", stage="display"):
+                        self.display(img)
+                except Exception:
+                    metrics.inc("errors_total", stage="display")
+                    logger.exception("Updating the display failed")
+                    continue
+                metrics.inc("display_updates_total", kind=kind)
+                if kind == "forecast":
+                    print("Forecast and display successfully updated")
+                else:
+                    logger.warning("Displayed error image")
+        finally:
+            self.stop()
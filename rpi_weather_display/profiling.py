@@ -0,0 +1,252 @@
+import gc
+import logging
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+logger = logging.getLogger("profiling")
+
+
+# __import__ is used as importlib.import_module bypasses the -X importtime
+# instrumentation for the top level module
+_import_script = """
+import sys
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except Exception as e:
+        print(f"{name}: {e!r}")
+"""
+
+
+def profile_imports(modules: list, top: int = 25):
+    """
+    Imports the given modules in a fresh interpreter with `-X importtime`
+
+    Returns a list of (module, self_us, cumulative_us) sorted by cumulative
+    time, most expensive first, and a list of modules that failed to import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _import_script] + modules,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        records.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    records.sort(key=lambda r: r[2], reverse=True)
+    return records[:top], result.stdout.splitlines()
+
+
+def format_import_profile(records: list, failures: list = ()):
+    """
+    Formats the output of profile_imports as a table
+    """
+    lines = [f"{'cumulative':>12} {'self':>10}  module"]
+    for name, self_us, cumulative_us in records:
+        lines.append(
+            f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {name}"
+        )
+    for failure in failures:
+        lines.append(f"Failed to import {failure}")
+    return "\n".join(lines)
+
+
+def rss_bytes():
+    """
+    Returns the resident set size of this process in bytes, or None if it
+    can't be read
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+
+        # Peak rather than current RSS, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class memoryProfiler(object):
+    """
+    Follows memory use of a long running process from cycle to cycle
+
+    Tracing starts at the first sample(), so everything allocated while
+    importing and warming up isn't traced and only what is allocated after
+    the first cycle is followed, which is where leaks show up. Each sample
+    returns the allocation sites that grew most since the previous one,
+    along with RSS and the gc generation counts. Only one frame is kept per
+    allocation so the overhead is low enough to leave on.
+
+    When RSS has grown by more than `threshold_mb` since the first sample a
+    report of the growth since then is written to `report_path`, and again
+    for every further threshold_mb.
+    """
+
+    # The profiler's own bookkeeping would otherwise show up as growth
+    ignored = ("<frozen importlib", "<unknown>", tracemalloc.__file__, __file__)
+
+    def __init__(
+            self,
+            top: int = 10,
+            threshold_mb: float = 50,
+            report_path: str = "memory-report.txt",
+            frames: int = 1,
+        ):
+        self.top = top
+        self.threshold = threshold_mb * 1024 * 1024
+        self.report_path = report_path
+        self.frames = frames
+        self.cycles = 0
+        self.first_stats = None
+        self.previous_stats = None
+        self.first_rss = None
+        self.next_report_rss = None
+        self.last = {}
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def _statistics(self):
+        """
+        Returns {allocation site: (size, count)} for the traced memory
+        """
+        stats = {}
+        for stat in tracemalloc.take_snapshot().statistics("lineno"):
+            frame = stat.traceback[0]
+            if frame.filename.startswith(self.ignored):
+                continue
+            stats[f"{frame.filename}:{frame.lineno}"] = (stat.size, stat.count)
+        return stats
+
+    def _growth(self, stats: dict, since: dict):
+        """
+        Returns [(site, size_diff, count_diff, size)] for the sites that grew,
+        largest growth first
+        """
+        growth = []
+        for site, (size, count) in stats.items():
+            old_size, old_count = since.get(site, (0, 0))
+            if size > old_size:
+                growth.append((site, size - old_size, count - old_count, size))
+        growth.sort(key=lambda g: g[1], reverse=True)
+        return growth
+
+    def sample(self):
+        """
+        Returns a dict with rss, traced, gc_counts, gc_collections and growth,
+        a list of (site, size_diff, count_diff, size) since the previous sample
+        """
+        start = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+        stats = self._statistics()
+        rss = rss_bytes()
+        traced, _ = tracemalloc.get_traced_memory()
+
+        growth = []
+        if self.previous_stats is not None:
+            growth = self._growth(stats, self.previous_stats)[: self.top]
+        else:
+            self.first_stats = stats
+            self.first_rss = rss
+            if rss is not None:
+                self.next_report_rss = rss + self.threshold
+        self.previous_stats = stats
+        self.cycles += 1
+
+        self.last = {
+            "cycle": self.cycles,
+            "rss": rss,
+            "traced": traced,
+            "gc_counts": gc.get_count(),
+            "gc_collections": tuple(s["collections"] for s in gc.get_stats()),
+            "growth": growth,
+            "seconds": time.perf_counter() - start,
+        }
+
+        if self.next_report_rss is not None and rss >= self.next_report_rss:
+            self.write_report(stats)
+            while self.next_report_rss <= rss:
+                self.next_report_rss += self.threshold
+
+        return self.last
+
+    def format_sample(self, sample: dict = None):
+        """
+        Formats a sample as a few lines for the log
+        """
+        sample = sample or self.last
+        rss = "unknown" if sample["rss"] is None else f"{sample['rss'] / 1048576:.1f} MB"
+        lines = [
+            f"Memory cycle {sample['cycle']}: RSS {rss}, "
+            f"traced {sample['traced'] / 1048576:.1f} MB, "
+            f"gc counts {sample['gc_counts']}, collections {sample['gc_collections']}, "
+            f"snapshot took {sample['seconds'] * 1000:.0f} ms"
+        ]
+        for site, size_diff, count_diff, _ in sample["growth"]:
+            lines.append(f"  +{size_diff / 1024:9.1f} KiB {count_diff:+7d} blocks  {site}")
+        return "\n".join(lines)
+
+    def write_report(self, stats: dict = None, top: int = 50):
+        """
+        Writes the allocation sites that grew most since the first sample
+        """
+        stats = stats if stats is not None else self._statistics()
+        rss = rss_bytes()
+        if rss is None or self.first_rss is None:
+            rss_line = "RSS unknown"
+        else:
+            rss_line = (
+                f"RSS {rss / 1048576:.1f} MB, "
+                f"{(rss - self.first_rss) / 1048576:+.1f} MB since the first cycle"
+            )
+        lines = [
+            f"Memory report at {time.strftime('%Y-%m-%d %H:%M:%S')} after {self.cycles} cycles",
+            rss_line,
+            f"gc counts {gc.get_count()}, garbage {len(gc.garbage)}",
+            "",
+            "Growth by allocation site since the first cycle:",
+        ]
+        for site, size_diff, count_diff, size in self._growth(stats, self.first_stats or {})[:top]:
+            lines.append(
+                f"  {size_diff / 1024:+10.1f} KiB {count_diff:+8d} blocks  "
+                f"{size / 1024:10.1f} KiB total  {site}"
+            )
+
+        tmp_path = f"{self.report_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.report_path)
+            logger.warning(f"Memory grew past the threshold, wrote report to {self.report_path}")
+        except OSError as e:
+            logger.warning(f"Unable to write memory report to {self.report_path}: {e}")
+
+    def stats(self):
+        """
+        Returns the last sample's numbers for the metrics gauge
+        """
+        if not self.last:
+            return {}
+        stats = {"rss_bytes": self.last["rss"] or 0, "traced_bytes": self.last["traced"]}
+        for generation, count in enumerate(self.last["gc_collections"]):
+            stats[f"gc_collections_gen{generation}"] = count
+        return stats
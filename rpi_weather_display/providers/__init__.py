@@ -1,7 +1,147 @@
 # -*- coding: utf-8 -*-
 
-from .owm import owmWeather
-from .tomorrow import tomorrow
+import importlib
 
-# Not used
-# from .metno import metNorway
+
+# Providers are imported on first use so that only the selected one is loaded
+_lazy_names = {
+    "hedgedProvider": ".hedged",
+    "metNorway": ".metno",
+    "owmWeather": ".owm",
+    "staleProvider": ".stale",
+    "tomorrow": ".tomorrow",
+}
+
+__all__ = list(_lazy_names) + ["create_provider", "split_providers"]
+
+# Command line names of the providers, and those that work without an API key
+provider_names = ("tomorrow", "openweather", "metno")
+keyless_providers = ("metno",)
+
+
+def split_providers(name: str, api_key: str = None):
+    """
+    Returns (name, api key) pairs from comma separated lists of provider
+    names and API keys
+
+    A single key is used for every provider, otherwise there must be one
+    key per provider, left empty for those that don't need one.
+    """
+    names = [n.strip() for n in name.split(",") if n.strip()]
+    keys = [k.strip() or None for k in api_key.split(",")] if api_key else [None]
+    if len(keys) == 1:
+        keys = keys * len(names)
+    elif len(keys) != len(names):
+        raise ValueError("Give one API key for all weather providers or one per provider")
+
+    for n, k in zip(names, keys):
+        if n not in provider_names:
+            raise ValueError(f"Unknown weather provider {n}, use {', '.join(provider_names)}")
+        if not k and n not in keyless_providers:
+            raise ValueError(f"An API key is required for the {n} weather provider")
+    return list(zip(names, keys))
+
+
+def create_provider(
+        name: str,
+        lat: float,
+        long: float,
+        api_key: str = None,
+        cache=None,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        hedge_after: float = 2.0,
+        max_stale: float = 24 * 3600,
+    ):
+    """
+    Returns a weather provider by its command line name, 'tomorrow',
+    'openweather' or 'metno'
+
+    A comma separated list of names, with one API key or a comma separated
+    list of keys, returns a hedgedProvider over all of them, best first.
+    The provider is wrapped in a staleProvider that serves the last good
+    forecast for up to `max_stale` seconds when fetching fails, 0 turns
+    that off.
+    """
+    provider = _create_provider(
+        name,
+        lat=lat,
+        long=long,
+        api_key=api_key,
+        cache=cache,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        hedge_after=hedge_after,
+    )
+    if max_stale > 0:
+        provider = __getattr__("staleProvider")(provider, max_age=max_stale)
+    return provider
+
+
+def _create_provider(
+        name: str,
+        lat: float,
+        long: float,
+        api_key: str = None,
+        cache=None,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        hedge_after: float = 2.0,
+    ):
+    if "," in name:
+        return __getattr__("hedgedProvider")(
+            [
+                _create_provider(
+                    n,
+                    lat=lat,
+                    long=long,
+                    api_key=k,
+                    cache=cache,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                )
+                for n, k in split_providers(name, api_key)
+            ],
+            hedge_after=hedge_after,
+        )
+    elif name == "tomorrow":
+        return __getattr__("tomorrow")(
+            lat=lat,
+            long=long,
+            api_key=api_key,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            cache=cache,
+        )
+    elif name == "openweather":
+        return __getattr__("owmWeather")(
+            lat=lat,
+            long=long,
+            api_key=api_key,
+            cache=cache,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+        )
+    elif name == "metno":
+        return __getattr__("metNorway")(
+            lat=lat,
+            long=long,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            cache=cache,
+        )
+    else:
+        raise ValueError(f"Unknown weather provider {name}")
+
+
+def __getattr__(name):
+    if name in _lazy_names:
+        module = importlib.import_module(_lazy_names[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from ..metrics import metrics
+
+
+logger = logging.getLogger("hedgedProvider")
+
+
+class providerStats(object):
+    """
+    Exponentially weighted moving averages of one provider's latency and
+    error rate
+    """
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool):
+        """
+        Adds the outcome of a request, failures don't update the latency
+        """
+        with self.lock:
+            self.requests += 1
+            if ok:
+                if self.latency is None:
+                    self.latency = seconds
+                else:
+                    self.latency += self.alpha * (seconds - self.latency)
+            else:
+                self.errors += 1
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+
+    def score(self, budget: float):
+        """
+        Returns the expected cost of asking this provider first, lower is
+        better. A provider that hasn't answered yet is assumed to take the
+        whole budget, and every 10% of errors costs another budget.
+        """
+        with self.lock:
+            latency = self.latency if self.latency is not None else budget
+            return latency + self.error_rate * 10 * budget
+
+
+class hedgedProvider(object):
+    """
+    Combines several weather providers into one, asking the currently best
+    provider first and hedging with the next one when it is slow
+
+    The provider with the lowest latency and error rate so far is the
+    primary. If it hasn't returned a valid forecast within `hedge_after`
+    seconds the next best provider is asked as well, and so on, and the
+    first valid forecast wins. A provider that fails is replaced by the next
+    one straight away. Requests that lose keep running in the background
+    and still count towards their provider's statistics, and a provider
+    whose previous request is still running isn't asked again.
+    """
+
+    def __init__(self, providers: list, hedge_after: float = 2.0, alpha: float = 0.3):
+        if not providers:
+            raise ValueError("At least one weather provider is needed")
+        self.providers = list(providers)
+        self.names = [p.provider_name for p in self.providers]
+        self.hedge_after = hedge_after
+        self.stats_by_provider = [providerStats(alpha) for _ in self.providers]
+        self.provider_name = self.names[0]
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.providers), thread_name_prefix="provider"
+        )
+
+    def _valid(self, snapshot):
+        return (
+            snapshot is not None
+            and len(snapshot.hourly_time) > 1
+            and len(snapshot.daily_time) > 0
+            and bool(snapshot.current)
+        )
+
+    def _call(self, i: int, hours: int, days: int):
+        start = time.perf_counter()
+        try:
+            snapshot = self.providers[i].get_snapshot(hours, days)
+            if not self._valid(snapshot):
+                raise ValueError(f"{self.names[i]} returned an incomplete forecast")
+        except Exception:
+            self.stats_by_provider[i].record(time.perf_counter() - start, ok=False)
+            raise
+        self.stats_by_provider[i].record(time.perf_counter() - start, ok=True)
+        return snapshot
+
+    def _submit(self, i: int, hours: int, days: int):
+        """
+        Returns a future for provider i, reusing its previous request if it
+        is still running
+        """
+        with self.lock:
+            future = self.inflight.get(i)
+            if future is None or future.done():
+                future = self.executor.submit(self._call, i, hours, days)
+                self.inflight[i] = future
+            return future
+
+    def ranking(self):
+        """
+        Returns the provider indexes, best first
+        """
+        return sorted(
+            range(len(self.providers)),
+            key=lambda i: (self.stats_by_provider[i].score(self.hedge_after), i),
+        )
+
+    def get_snapshot(self, hours=24, days=7):
+        """
+        Returns the first valid ForecastSnapshot from the providers
+        """
+        remaining = self.ranking()
+        pending = {}
+        errors = []
+
+        def launch(hedge: bool):
+            i = remaining.pop(0)
+            if hedge:
+                with self.stats_by_provider[i].lock:
+                    self.stats_by_provider[i].hedges += 1
+                metrics.inc("provider_hedges_total", provider=self.names[i])
+                logger.info(f"Asking {self.names[i]} as well after {self.hedge_after}s")
+            pending[self._submit(i, hours, days)] = i
+            return time.monotonic() + self.hedge_after
+
+        deadline = launch(hedge=False)
+        while pending:
+            timeout = max(0, deadline - time.monotonic()) if remaining else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                deadline = launch(hedge=True)
+                continue
+
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    snapshot = future.result()
+                except Exception as e:
+                    logger.warning(f"Weather provider {self.names[i]} failed: {e}")
+                    errors.append((self.names[i], e))
+                    continue
+                with self.stats_by_provider[i].lock:
+                    self.stats_by_provider[i].wins += 1
+                self.provider_name = self.names[i]
+                metrics.inc("provider_wins_total", provider=self.names[i])
+                return snapshot
+
+            # Everything that finished failed, fail over without waiting
+            if remaining:
+                deadline = launch(hedge=False)
+
+        raise Exception(
+            "All weather providers failed: "
+            + "; ".join(f"{name}: {e}" for name, e in errors)
+        ) from errors[-1][1]
+
+    def get_daily_data(self, days=7):
+        """
+        Returns a list of daily weather data
+        """
+        return self.get_snapshot(days=days).daily_records(days)
+
+    def get_hourly_data(self, hours=24):
+        """
+        Returns a list of hourly rain and temperature values
+        """
+        return self.get_snapshot(hours=hours).hourly_records(hours)
+
+    def get_current_weather(self):
+        """
+        Returns a dict of the current weather
+        """
+        return dict(self.get_snapshot().current)
+
+    def stats(self):
+        """
+        Returns each provider's latency, error rate, wins and hedges for the
+        metrics gauge
+        """
+        result = {}
+        for name, s in zip(self.names, self.stats_by_provider):
+            with s.lock:
+                result[f"{name}:latency_seconds"] = s.latency or 0
+                result[f"{name}:error_rate"] = s.error_rate
+                result[f"{name}:wins"] = s.wins
+                result[f"{name}:hedges"] = s.hedges
+        return result
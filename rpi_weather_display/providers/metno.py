@@ -1,47 +1,309 @@
 import logging
-from metno_locationforecast import Place, Forecast
+import math
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from ..cache import forecastCache, default_cache
+from ..fetch import httpFetcher
+from ..metrics import metrics
+from ..snapshot import ForecastSnapshot
 
 
-logger = logging.getLogger("owmWeather")
+logger = logging.getLogger("metNorway")
+
+
+# met.no symbol codes without the _day/_night/_polartwilight suffix mapped to
+# an icon code and description
+symbol_icons = {
+    "clearsky": ("01", "Clear, Sunny"),
+    "fair": ("02", "Fair"),
+    "partlycloudy": ("03", "Partly Cloudy"),
+    "cloudy": ("04", "Cloudy"),
+    "fog": ("50", "Fog"),
+    "lightrainshowers": ("09", "Light Rain Showers"),
+    "rainshowers": ("09", "Rain Showers"),
+    "heavyrainshowers": ("10", "Heavy Rain Showers"),
+    "lightrain": ("09", "Light Rain"),
+    "rain": ("10", "Rain"),
+    "heavyrain": ("10", "Heavy Rain"),
+    "lightsleetshowers": ("13", "Light Sleet Showers"),
+    "sleetshowers": ("13", "Sleet Showers"),
+    "heavysleetshowers": ("13", "Heavy Sleet Showers"),
+    "lightsleet": ("13", "Light Sleet"),
+    "sleet": ("13", "Sleet"),
+    "heavysleet": ("13", "Heavy Sleet"),
+    "lightsnowshowers": ("13", "Light Snow Showers"),
+    "snowshowers": ("13", "Snow Showers"),
+    "heavysnowshowers": ("13", "Heavy Snow Showers"),
+    "lightsnow": ("13", "Light Snow"),
+    "snow": ("13", "Snow"),
+    "heavysnow": ("13", "Heavy Snow"),
+}
 
 
 class metNorway(object):
     """
-    An interface to the Norwegian Meteorological Institute API
-
-    Example:
-        home = Place("Berlin", 52.52437, 13.41053, 34)
-        forecast = Forecast(home, "github.com/FutureSharks/rpi-weather-display 1.0")
-        forecast.update()
+    An interface to the Norwegian Meteorological Institute Locationforecast API
 
+    The API is free but asks clients to identify themselves with a
+    User-Agent and to follow its caching headers. Responses are cached until
+    their Expires time, and refetches send If-Modified-Since so an unchanged
+    forecast comes back as an empty 304 that isn't parsed again.
     """
 
-    def __init__(self, place_name, lat, long, altitude=0):
-        self.place_name = place_name
-        self.lat = lat
-        self.long = long
-        self.altitude = altitude
-        self.home = Place(place_name, self.lat, self.long, self.altitude)
-        self.forecast = Forecast(
-            home, "github.com/FutureSharks/rpi-weather-display 1.0"
+    def __init__(
+            self,
+            lat,
+            long,
+            api_key=None,
+            connect_timeout=5,
+            read_timeout=30,
+            cache=None,
+            stale_age=6 * 3600,
+            stale_wait=5,
+            altitude=None,
+            user_agent="rpi-weather-display/1.1 github.com/FutureSharks/rpi-weather-display",
+        ):
+        self.provider_name = "MET Norway"
+        self.cache = cache if cache is not None else default_cache()
+        # Used when a response has no Expires header, and as a lower bound
+        self.cache_age = 1800
+        self.min_cache_age = 60
+        self.stale_age = stale_age
+        self.stale_wait = stale_wait
+        # The API rejects coordinates with more than 4 decimals
+        self.lat = round(lat, 4)
+        self.long = round(long, 4)
+        self.api_endpoint = "https://api.met.no/weatherapi/locationforecast/2.0/compact"
+        self.query_string = {"lat": self.lat, "lon": self.long}
+        if altitude is not None:
+            self.query_string["altitude"] = int(altitude)
+        self.cache_key = forecastCache.key("metno", self.lat, self.long, "compact")
+        self.fetcher = httpFetcher(
+            "metno", connect_timeout=connect_timeout, read_timeout=read_timeout
         )
-        self.forecast.update()
+        self.fetcher.session.headers["User-Agent"] = user_agent
+        self.raw_data = None
+        self.snapshot = None
 
-    def get_hourly_data(self, hours=24):
+    def _expires(self, response):
         """
-        Returns a list of hourly rain and temperature values
+        Returns the response's Expires header as epoch seconds
         """
-        self.forecast.update()
+        try:
+            return parsedate_to_datetime(response.headers["Expires"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return time.time() + self.cache_age
+
+    def _ttl(self, data):
+        return max(data["expires"] - time.time(), self.min_cache_age)
 
-        results = []
+    def _get_data(self):
+        """
+        Returns {"forecast", "last_modified", "expires"}, reusing the cached
+        forecast if the server says it hasn't changed
+        """
+        previous, _ = self.cache.get(self.cache_key)
+        headers = {}
+        if previous and previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
 
-        for hour in forecast.data.intervals[0:hours]:
-            h = {
-                "date": hour.start_time,
-                "air_temperature": hour.variables["air_temperature"].value,
-                "precipitation_amount": hour.variables["precipitation_amount"].value,
+        try:
+            with metrics.time("provider_request_seconds", provider="metno"):
+                response = self.fetcher.get(
+                    self.api_endpoint, params=self.query_string, headers=headers
+                )
+
+            if response.status_code == 304 and previous:
+                metrics.inc("provider_not_modified_total", provider="metno")
+                logger.debug("Forecast not modified")
+                return dict(previous, expires=self._expires(response))
+
+            response.raise_for_status()
+            return {
+                "forecast": response.json(),
+                "last_modified": response.headers.get("Last-Modified"),
+                "expires": self._expires(response),
             }
+        except Exception as e:
+            metrics.inc("provider_errors_total", provider="metno")
+            logger.error(f"met.no request failed: {e}")
+            raise
+
+    def update_forcast(self):
+        """
+        Refreshes the forecast when it has expired, reading through the
+        forecast cache
+        """
+        data, stored_at, expired = self.cache.fetch_entry(
+            self.cache_key,
+            self._get_data,
+            ttl=self.cache_age,
+            stale_ttl=self.stale_age,
+            wait=self.stale_wait,
+            ttl_from=self._ttl,
+        )
+
+        # A 304 keeps the same forecast object, so there is nothing to parse
+        if self.raw_data is not None and data["forecast"] is self.raw_data["forecast"]:
+            logger.debug("Forecast unchanged since last update")
+        else:
+            logger.debug("Updating forecast")
+            self.timeseries = data["forecast"]["properties"]["timeseries"]
+            self.snapshot = self._build_snapshot()
+        self.raw_data = data
+
+        # A 304 confirms the forecast is current, so it counts as fetched then
+        self.snapshot.fetched_at = stored_at
+        self.snapshot.stale = expired
+
+    def _parse_time(self, t):
+        return datetime.strptime(t, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+    def _map_weather_icon_name(self, symbol_code, day_or_night=None):
+        """
+        Converts a met.no symbol code like 'lightrainshowers_night' into an
+        icon name and description
+        """
+        name, _, variant = symbol_code.partition("_")
+        if name.endswith("andthunder"):
+            code, description = ("11", "Thunderstorm")
+        elif name in symbol_icons:
+            code, description = symbol_icons[name]
+        else:
+            logger.warning(f"Unknown symbol code from met.no: {symbol_code}")
+            code, description = ("00", "Unknown")
+
+        if day_or_night is None:
+            day_or_night = "n" if variant == "night" else "d"
+
+        return f"{code}{day_or_night}", description
+
+    def _apparent_temperature(self, details):
+        """
+        Returns the apparent temperature from temperature, humidity and wind,
+        as the compact forecast has no feels like temperature
+        """
+        temperature = details["air_temperature"]
+        humidity = details.get("relative_humidity")
+        wind_speed = details.get("wind_speed")
+        if humidity is None or wind_speed is None:
+            return temperature
+        vapour_pressure = humidity / 100 * 6.105 * math.exp(17.27 * temperature / (237.7 + temperature))
+        return round(temperature + 0.33 * vapour_pressure - 0.70 * wind_speed - 4.00, 1)
+
+    def _precipitation(self, entry, period):
+        """
+        Returns the precipitation in mm for the next 1 or 6 hours of an entry
+        """
+        return entry["data"].get(period, {}).get("details", {}).get("precipitation_amount", 0)
+
+    def _current_weather(self):
+        entry = self.timeseries[0]
+        details = entry["data"]["instant"]["details"]
+        next_hours = entry["data"].get("next_1_hours") or entry["data"].get("next_6_hours", {})
+        symbol_code = next_hours.get("summary", {}).get("symbol_code", "")
+
+        result = {}
+        result["temperature"] = details["air_temperature"]
+        result["temperature_feels_like"] = self._apparent_temperature(details)
+        result["weather_icon_name"], result["description"] = self._map_weather_icon_name(symbol_code)
+        result["rain"] = self._precipitation(entry, "next_1_hours")
 
-            results.append(h)
+        return result
+
+    def _daily(self):
+        """
+        Aggregates the timeseries into local calendar days
+
+        Returns a list of (time, min, max, rain, icon) per day. The time is
+        UTC midnight of the local date, which is how the renderers read
+        daily times. Entries are hourly for the first days and 6 hourly
+        after that, rain is summed over the period up to the next entry and
+        the icon is the 6 hour symbol closest to midday.
+        """
+        days = {}
+        times = [self._parse_time(e["time"]) for e in self.timeseries]
+        for i, (t, entry) in enumerate(zip(times, self.timeseries)):
+            local = datetime.fromtimestamp(t, timezone.utc).astimezone()
+            day_time = datetime(local.year, local.month, local.day, tzinfo=timezone.utc).timestamp()
+            day = days.setdefault(
+                local.date(),
+                {"time": day_time, "temperatures": [], "rain": 0, "symbol": None, "symbol_distance": None},
+            )
+            day["temperatures"].append(entry["data"]["instant"]["details"]["air_temperature"])
+
+            step = times[i + 1] - t if i + 1 < len(times) else 3600
+            if step <= 3600 and "next_1_hours" in entry["data"]:
+                day["rain"] += self._precipitation(entry, "next_1_hours")
+            elif "next_6_hours" in entry["data"]:
+                day["rain"] += self._precipitation(entry, "next_6_hours")
+
+            symbol_code = entry["data"].get("next_6_hours", {}).get("summary", {}).get("symbol_code")
+            distance = abs(local.hour - 12)
+            if symbol_code and (day["symbol"] is None or distance < day["symbol_distance"]):
+                day["symbol"] = symbol_code
+                day["symbol_distance"] = distance
+
+        return [
+            (
+                day["time"],
+                min(day["temperatures"]),
+                max(day["temperatures"]),
+                round(day["rain"], 1),
+                self._map_weather_icon_name(day["symbol"] or "", day_or_night="d")[0],
+            )
+            for day in days.values()
+        ]
+
+    def _build_snapshot(self):
+        """
+        Converts the API response into a ForecastSnapshot
+        """
+        hourly = [e for e in self.timeseries if "next_1_hours" in e["data"]]
+        daily = self._daily()
+
+        return ForecastSnapshot(
+            provider_name=self.provider_name,
+            current=self._current_weather(),
+            hourly_time=[self._parse_time(h["time"]) for h in hourly],
+            hourly_temperature=[h["data"]["instant"]["details"]["air_temperature"] for h in hourly],
+            hourly_rain=[self._precipitation(h, "next_1_hours") for h in hourly],
+            daily_time=[d[0] for d in daily],
+            daily_temperature_min=[d[1] for d in daily],
+            daily_temperature_max=[d[2] for d in daily],
+            daily_rain=[d[3] for d in daily],
+            daily_icon=[d[4] for d in daily],
+        )
+
+    def get_snapshot(self, hours=24, days=7):
+        """
+        Returns a ForecastSnapshot of the forecast
+        """
+        self.update_forcast()
+
+        return self.snapshot.head(hours, days)
+
+    def get_daily_data(self, days=7):
+        """
+        Returns a list of daily weather data
+        """
+        self.update_forcast()
+
+        return self.snapshot.daily_records(days)
+
+    def get_hourly_data(self, hours=24):
+        """
+        Returns a list of hourly rain and temperature values
+        """
+        self.update_forcast()
+
+        return self.snapshot.hourly_records(hours)
+
+    def get_current_weather(self):
+        """
+        Returns a dict of the current weather
+        """
+        self.update_forcast()
 
-        return results
+        return self._current_weather()
@@ -1,63 +1,152 @@
 import logging
-import time
-from pyowm import OWM
-from datetime import datetime, timezone
+from ..cache import forecastCache, default_cache
+from ..fetch import httpFetcher
+from ..metrics import metrics
+from ..snapshot import ForecastSnapshot
 
 
 logger = logging.getLogger("owmWeather")
 
 
+def kelvin_to_celsius(kelvin):
+    """
+    Converts a temperature from the API to Celsius, rounded to 2 decimals
+    like pyowm does
+    """
+    if kelvin is None or kelvin < 0:
+        return kelvin
+    return float(f"{kelvin - 273.15:.2f}")
+
+
 class owmWeather(object):
     """
-    An interface to OpenWeatherMap API
+    An interface to the OpenWeatherMap One Call API
+
+    The JSON response is requested through an httpFetcher and parsed
+    once per fetch straight into a ForecastSnapshot, without building
+    pyowm's Weather objects. Temperatures are requested in Kelvin and
+    converted like pyowm so the output and the cached responses are the
+    same as before.
     """
 
-    def __init__(self, lat, long, api_key):
+    def __init__(
+            self,
+            lat,
+            long,
+            api_key,
+            cache=None,
+            stale_age=6 * 3600,
+            stale_wait=5,
+            connect_timeout=5,
+            read_timeout=30,
+        ):
         self.provider_name = "OpenWeatherMap"
         self.lat = lat
         self.long = long
-        self.owm = OWM(api_key)
-        self.mgr = self.owm.weather_manager()
-        self.update_forcast()
+        self.api_key = api_key
+        self.api_endpoint = "https://api.openweathermap.org/data/2.5/onecall"
+        self.query_string = {"lat": self.lat, "lon": self.long, "appid": self.api_key, "lang": "en"}
+        self.cache = cache if cache is not None else default_cache()
+        self.cache_age = 300
+        self.stale_age = stale_age
+        self.stale_wait = stale_wait
+        self.cache_key = forecastCache.key("openweather", self.lat, self.long, "onecall")
+        self.fetcher = httpFetcher(
+            "openweather", connect_timeout=connect_timeout, read_timeout=read_timeout
+        )
+        self.raw_data = None
+        self.snapshot = None
+
+    def _get_data(self):
+        try:
+            with metrics.time("provider_request_seconds", provider="openweather"):
+                response = self.fetcher.get(self.api_endpoint, params=self.query_string)
+                response.raise_for_status()
+                return response.json()
+        except Exception as e:
+            metrics.inc("provider_errors_total", provider="openweather")
+            logger.error(f"OpenWeatherMap request failed: {e}")
+            raise
 
     def update_forcast(self):
         """
-        Refreshes forecast
+        Refreshes forecast, reading through the forecast cache
         """
-        if (
-            not hasattr(self, "one_call")
-            or time.time() - self.one_call.current.to_dict()["reference_time"] > 300
-        ):
+        data, stored_at, expired = self.cache.fetch_entry(
+            self.cache_key,
+            self._get_data,
+            ttl=self.cache_age,
+            stale_ttl=self.stale_age,
+            wait=self.stale_wait,
+        )
+
+        if data is not self.raw_data:
             logger.debug("Updating forecast")
-            self.one_call = self.mgr.one_call(lat=self.lat, lon=self.long)
-        else:
-            return
+            self.snapshot = self._build_snapshot(data)
+            self.raw_data = data
 
-    def get_daily_data(self, days=7):
+        # The snapshot is as old as the cached response it was built from
+        self.snapshot.fetched_at = stored_at
+        self.snapshot.stale = expired
+
+    def _rain(self, weather, period):
         """
-        Returns a list of daily weather data
+        Returns the rain of an hour ("1h") or a day ("all") in mm, daily
+        values are a plain number in the response
         """
-        self.update_forcast()
-
-        results = []
-
-        for day in self.one_call.forecast_daily[0:days]:
-            d = {}
+        rain = weather.get("rain", weather.get("precipitation"))
+        if rain is None:
+            return 0
+        if isinstance(rain, (int, float)):
+            return rain if period == "all" else 0
+        return rain.get(period, 0)
+
+    def _current_weather(self, current):
+        status = current["weather"][0] if current.get("weather") else {}
+
+        return {
+            "temperature": kelvin_to_celsius(current["temp"]),
+            "temperature_feels_like": kelvin_to_celsius(current.get("feels_like")),
+            "description": status.get("description", ""),
+            "weather_icon_name": status.get("icon", ""),
+            "rain": self._rain(current, "1h"),
+        }
 
-            d["time"] = datetime.utcfromtimestamp(day.to_dict()["reference_time"])
-            d["temperature_min"] = day.temperature("celsius")["min"]
-            d["temperature_day"] = day.temperature("celsius")["day"]
-            d["temperature_max"] = day.temperature("celsius")["max"]
-            d["weather_icon_name"] = day.weather_icon_name
+    def _build_snapshot(self, data):
+        """
+        Converts the One Call response into a ForecastSnapshot
+        """
+        hourly = data.get("hourly", [])
+        daily = data.get("daily", [])
+
+        return ForecastSnapshot(
+            provider_name=self.provider_name,
+            current=self._current_weather(data["current"]),
+            hourly_time=[hour["dt"] for hour in hourly],
+            hourly_temperature=[kelvin_to_celsius(hour["temp"]) for hour in hourly],
+            hourly_rain=[self._rain(hour, "1h") for hour in hourly],
+            daily_time=[day["dt"] for day in daily],
+            daily_temperature_min=[kelvin_to_celsius(day["temp"]["min"]) for day in daily],
+            daily_temperature_max=[kelvin_to_celsius(day["temp"]["max"]) for day in daily],
+            daily_rain=[self._rain(day, "all") for day in daily],
+            daily_icon=[day["weather"][0]["icon"] if day.get("weather") else "" for day in daily],
+        )
+
+    def get_snapshot(self, hours=24, days=7):
+        """
+        Returns a ForecastSnapshot of the forecast
+        """
+        self.update_forcast()
 
-            if "all" in day.rain:
-                d["rain"] = day.rain["all"]
-            else:
-                d["rain"] = 0
+        return self.snapshot.head(hours, days)
 
-            results.append(d)
+    def get_daily_data(self, days=7):
+        """
+        Returns a list of daily weather data
+        """
+        self.update_forcast()
 
-        return results
+        return self.snapshot.daily_records(days)
 
     def get_hourly_data(self, hours=24):
         """
@@ -65,26 +154,7 @@ class owmWeather(object):
         """
         self.update_forcast()
 
-        results = []
-
-        for hour in self.one_call.forecast_hourly[0:hours]:
-            h = {}
-
-            h["time"] = (
-                datetime.utcfromtimestamp(hour.to_dict()["reference_time"])
-                .replace(tzinfo=timezone.utc)
-                .astimezone(tz=None)
-            )
-            h["temperature"] = hour.temperature("celsius")["temp"]
-
-            if "1h" in hour.rain:
-                h["rain"] = hour.rain["1h"]
-            else:
-                h["rain"] = 0
-
-            results.append(h)
-
-        return results
+        return self.snapshot.hourly_records(hours)
 
     def get_current_weather(self):
         """
@@ -92,18 +162,4 @@ class owmWeather(object):
         """
         self.update_forcast()
 
-        current = {
-            "temperature": self.one_call.current.temperature("celsius")["temp"],
-            "temperature_feels_like": self.one_call.current.temperature("celsius")[
-                "feels_like"
-            ],
-            "description": self.one_call.current.detailed_status,
-            "weather_icon_name": self.one_call.current.weather_icon_name,
-        }
-
-        if "1h" in self.one_call.current.rain:
-            current["rain"] = self.one_call.current.rain["1h"]
-        else:
-            current["rain"] = 0
-
-        return current
+        return dict(self.snapshot.current)
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from ..metrics import metrics
+
+
+logger = logging.getLogger("staleProvider")
+
+
+class staleDataError(Exception):
+    """
+    Raised when the only forecast available is older than `max_age`
+    """
+
+
+class staleProvider(object):
+    """
+    Keeps the last good snapshot of a provider and serves it again, marked
+    as stale, when fetching a new one fails
+
+    The display keeps showing the last forecast with a note of when it was
+    fetched instead of an error screen, for up to `max_age` seconds after
+    which the error is raised again. Snapshots the provider itself serves
+    from an expired cache entry are stale as well and count against the
+    same `max_age`. Other attributes are passed through to the wrapped
+    provider.
+    """
+
+    def __init__(self, provider, max_age: float = 24 * 3600):
+        self.provider = provider
+        self.max_age = max_age
+        self.last_good = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def _age(self, snapshot):
+        return time.time() - snapshot.fetched_at
+
+    def get_snapshot(self, hours=24, days=7):
+        """
+        Returns a ForecastSnapshot of the forecast, or the last good one with
+        stale set if the provider fails
+        """
+        try:
+            snapshot = self.provider.get_snapshot(hours, days)
+        except Exception as e:
+            with self.lock:
+                last_good = self.last_good
+            if last_good is None or self._age(last_good) > self.max_age:
+                raise
+            metrics.inc("provider_stale_total", provider=last_good.provider_name)
+            logger.warning(
+                f"Showing the forecast from {self._age(last_good) / 60:.0f} "
+                f"minutes ago, fetching a new one failed: {e}"
+            )
+            snapshot = last_good.head(hours, days)
+            snapshot.stale = True
+            return snapshot
+
+        with self.lock:
+            # A provider serving an expired cache entry may return older
+            # data than a snapshot kept from another provider
+            if (
+                snapshot.stale
+                and self.last_good is not None
+                and self.last_good.fetched_at > snapshot.fetched_at
+            ):
+                snapshot = self.last_good.head(hours, days)
+                snapshot.stale = True
+            else:
+                self.last_good = snapshot
+
+        if snapshot.stale:
+            if self._age(snapshot) > self.max_age:
+                raise staleDataError(
+                    f"The newest forecast from {snapshot.provider_name} is "
+                    f"{self._age(snapshot) / 3600:.1f} hours old"
+                )
+            metrics.inc("provider_stale_total", provider=snapshot.provider_name)
+            logger.warning(f"Showing the forecast from {self._age(snapshot) / 60:.0f} minutes ago")
+        return snapshot
+
+    def get_daily_data(self, days=7):
+        """
+        Returns a list of daily weather data
+        """
+        return self.get_snapshot(days=days).daily_records(days)
+
+    def get_hourly_data(self, hours=24):
+        """
+        Returns a list of hourly rain and temperature values
+        """
+        return self.get_snapshot(hours=hours).hourly_records(hours)
+
+    def get_current_weather(self):
+        """
+        Returns a dict of the current weather
+        """
+        return dict(self.get_snapshot().current)
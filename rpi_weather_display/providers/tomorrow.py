@@ -1,7 +1,10 @@
 import logging
-import time
 from datetime import datetime, timezone
 import requests
+from ..cache import forecastCache, default_cache
+from ..fetch import httpFetcher
+from ..metrics import metrics
+from ..snapshot import ForecastSnapshot
 
 
 logger = logging.getLogger()
@@ -10,38 +13,70 @@ class tomorrow(object):
     """
     An interface to Tomorrow.io API
     """
-    def __init__(self, lat, long, api_key):
+    def __init__(
+            self,
+            lat,
+            long,
+            api_key,
+            connect_timeout=5,
+            read_timeout=30,
+            cache=None,
+            stale_age=6 * 3600,
+            stale_wait=5,
+        ):
         self.provider_name = "Tomorrow.io"
+        self.cache = cache if cache is not None else default_cache()
         self.cache_age = 120
-        self.last_forecast_update = 0
+        self.stale_age = stale_age
+        self.stale_wait = stale_wait
         self.lat = lat
         self.long = long
         self.api_key = api_key
         self.api_endpoint = "https://api.tomorrow.io/v4/timelines"
+        # Fields needed from each timestep, fetched together in one request
+        self.timestep_fields = {
+            "1h": ["temperature", "temperatureApparent", "rainIntensity"],
+            "1d": ["temperatureMin", "temperatureMax", "rainIntensity", "weatherCodeFullDay"],
+            "current": ["temperature", "temperatureApparent", "rainIntensity", "weatherCode"],
+        }
+        fields = []
+        for timestep_fields in self.timestep_fields.values():
+            fields += [f for f in timestep_fields if f not in fields]
         self.default_query_string = {
             "location": f"{self.lat}, {self.long}",
-            "fields": ["temperature"],
+            "fields": fields,
             "units": "metric",
-            "timesteps": "1d",
+            "timesteps": list(self.timestep_fields),
             "apikey": self.api_key
         }
+        self.cache_key = forecastCache.key(
+            "tomorrow", self.lat, self.long, ",".join(self.timestep_fields)
+        )
+        self.fetcher = httpFetcher(
+            "tomorrow", connect_timeout=connect_timeout, read_timeout=read_timeout
+        )
+        self.raw_data = None
         self.hourly_data = None
         self.daily_data = None
         self.current_data = None
+        self.snapshot = None
 
     def _get_data(self, query_string):
         try:
-            response = requests.request("GET", self.api_endpoint, params=query_string)
-            data = response.json()
+            with metrics.time("provider_request_seconds", provider="tomorrow"):
+                response = self.fetcher.get(self.api_endpoint, params=query_string)
+                data = response.json()
 
             if data.get("code", None):
                 raise Exception(f"Tomorrow.io API error ({data['code']})): {data['type']}")
 
             return data
         except requests.JSONDecodeError as e:
+            metrics.inc("provider_errors_total", provider="tomorrow")
             print(e)
             raise
         except Exception as e:
+            metrics.inc("provider_errors_total", provider="tomorrow")
             print(e)
             raise
 
@@ -155,53 +190,81 @@ class tomorrow(object):
 
     def update_forcast(self):
         """
-        Refreshes the 3 types forecasts and saves them
+        Refreshes the 3 types forecasts with a single request and saves them,
+        reading through the forecast cache
         """
-        if None in [self.hourly_data, self.daily_data, self.current_data]:
-            pass
-        elif time.time() - self.last_forecast_update < self.cache_age:
-            logger.debug(f"Skipping forecast update as last update was done less than {self.cache_age} seconds ago")
-            return
+        data, stored_at, expired = self.cache.fetch_entry(
+            self.cache_key,
+            lambda: self._get_data(self.default_query_string),
+            ttl=self.cache_age,
+            stale_ttl=self.stale_age,
+            wait=self.stale_wait,
+        )
+
+        if data is self.raw_data:
+            logger.debug("Forecast unchanged since last update")
+        else:
+            logger.debug("Updating forecast hourly, daily and current data")
+            timelines = {t["timestep"]: t for t in data["data"]["timelines"]}
 
-        query_string = self.default_query_string.copy()
+            self.hourly_data = timelines["1h"]
+            self.daily_data = timelines["1d"]
+            self.current_data = timelines["current"]["intervals"][0]["values"]
+            self.snapshot = self._build_snapshot()
+            self.raw_data = data
 
-        query_string["timesteps"] = "1h"
-        query_string["fields"] = ["temperature", "temperatureApparent", "rainIntensity"]
-        logger.debug("Updating forecast hourly data")
-        self.hourly_data = self._get_data(query_string)
+        # The snapshot is as old as the cached response it was built from
+        self.snapshot.fetched_at = stored_at
+        self.snapshot.stale = expired
 
-        query_string["timesteps"] = "1d"
-        query_string["fields"] = ["temperatureMin", "temperatureMax", "rainIntensity", "weatherCodeFullDay"]
-        logger.debug("Updating forecast daily data")
-        self.daily_data = self._get_data(query_string)
+    def _parse_time(self, start_time):
+        return datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
 
-        query_string["timesteps"] = "current"
-        query_string["fields"] = ["temperature", "temperatureApparent", "rainIntensity", "weatherCode"]
-        logger.debug("Updating forecast current data")
-        self.current_data = self._get_data(query_string)["data"]["timelines"][0]["intervals"][0]["values"]
+    def _current_weather(self):
+        result = {}
 
-        self.last_forecast_update = time.time()
+        result["temperature"] = self.current_data["temperature"]
+        result["temperature_feels_like"] = self.current_data["temperatureApparent"]
+        result["weather_icon_name"], result["description"] = self._map_current_weather_icon_name(self.current_data["weatherCode"])
+        result["rain"] = self.current_data.get("rainIntensity", 0)
 
-        return
+        return result
 
-    def get_daily_data(self, days=7):
+    def _build_snapshot(self):
         """
-        Returns a list of daily weather data
+        Converts the API response into a ForecastSnapshot
+        """
+        hourly = self.hourly_data["intervals"]
+        daily = self.daily_data["intervals"]
+
+        return ForecastSnapshot(
+            provider_name=self.provider_name,
+            current=self._current_weather(),
+            hourly_time=[self._parse_time(h["startTime"]) for h in hourly],
+            hourly_temperature=[h["values"]["temperature"] for h in hourly],
+            hourly_rain=[h["values"].get("rainIntensity", 0) for h in hourly],
+            daily_time=[self._parse_time(d["startTime"]) for d in daily],
+            daily_temperature_min=[d["values"]["temperatureMin"] for d in daily],
+            daily_temperature_max=[d["values"]["temperatureMax"] for d in daily],
+            daily_rain=[d["values"].get("rainIntensity", 0) for d in daily],
+            daily_icon=[self._map_daily_weather_icon_name(d["values"]["weatherCodeFullDay"])[0] for d in daily],
+        )
+
+    def get_snapshot(self, hours=24, days=7):
+        """
+        Returns a ForecastSnapshot of the forecast
         """
         self.update_forcast()
 
-        results = []
+        return self.snapshot.head(hours, days)
 
-        for day in self.daily_data['data']['timelines'][0]['intervals'][0:days]:
-            d = {}
-            d["time"] = datetime.strptime(day["startTime"], "%Y-%m-%dT%H:%M:%SZ")
-            d["temperature_min"] = day["values"]["temperatureMin"]
-            d["temperature_max"] = day["values"]["temperatureMax"]
-            d["weather_icon_name"] = self._map_daily_weather_icon_name(day["values"]["weatherCodeFullDay"])[0]
-            d["rain"] = day["values"].get("rainIntensity", 0)
-            results.append(d)
+    def get_daily_data(self, days=7):
+        """
+        Returns a list of daily weather data
+        """
+        self.update_forcast()
 
-        return results
+        return self.snapshot.daily_records(days)
 
     def get_hourly_data(self, hours=24):
         """
@@ -209,16 +272,7 @@ class tomorrow(object):
         """
         self.update_forcast()
 
-        results = []
-
-        for hour in self.hourly_data['data']['timelines'][0]['intervals'][0:hours]:
-            h = {}
-            h["time"] = datetime.strptime(hour["startTime"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone(tz=None)
-            h["temperature"] = hour["values"]["temperature"]
-            h["rain"] = hour["values"].get("rainIntensity", 0)
-            results.append(h)
-
-        return results
+        return self.snapshot.hourly_records(hours)
 
     def get_current_weather(self):
         """
@@ -226,11 +280,4 @@ class tomorrow(object):
         """
         self.update_forcast()
 
-        result = {}
-
-        result["temperature"] = self.current_data["temperature"]
-        result["temperature_feels_like"] = self.current_data["temperatureApparent"]
-        result["weather_icon_name"], result["description"] = self._map_current_weather_icon_name(self.current_data["weatherCode"])
-        result["rain"] = self.current_data.get("rainIntensity", 0)
-
-        return result
+        return self._current_weather()
@@ -0,0 +1,100 @@
+import numpy as np
+from PIL import Image
+
+
+# The IT8951 panel shows 16 grey levels
+levels = 16
+
+
+def bayer_matrix(size: int = 4):
+    """
+    Returns the size x size ordered dithering matrix with values 0 to
+    size * size - 1
+    """
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while matrix.shape[0] < size:
+        matrix = np.block(
+            [[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]]
+        )
+    return matrix
+
+
+def _build_luts(size: int = 4):
+    """
+    Returns one 256 entry grey to level table per dithering threshold
+
+    A grey v maps to level (v * 15 + t) // 255 where t is in (0, 255), so
+    pure black and white are never dithered. The thresholds are spread
+    evenly, with the middle one rounding to the nearest level.
+    """
+    cells = size * size
+    grey = np.arange(256, dtype=np.int64)
+    thresholds = (2 * np.arange(cells) + 1) * 255 // (2 * cells)
+    return ((grey[None, :] * (levels - 1) + thresholds[:, None]) // 255).astype(np.uint8)
+
+
+dither_size = 4
+dither_luts = _build_luts(dither_size)
+dither_index = bayer_matrix(dither_size)
+
+# Rounds every grey to the nearest of the 16 levels
+level_lut = ((np.arange(256) * (levels - 1) + 127) // 255).astype(np.uint8)
+
+# Maps a level back to the 8-bit grey the panel shows for it
+grey_lut = (np.arange(levels) * (255 // (levels - 1))).astype(np.uint8)
+
+
+def quantize_levels(pixels: np.ndarray, dither: bool = False):
+    """
+    Maps 8-bit grey pixels to levels 0 to 15, optionally with ordered
+    dithering
+    """
+    if not dither:
+        return level_lut[pixels]
+
+    height, width = pixels.shape
+    index = np.tile(dither_index, (-(-height // dither_size), -(-width // dither_size)))
+    return dither_luts[index[:height, :width], pixels]
+
+
+def quantize_image(img: Image, dither: bool = False):
+    """
+    Returns an "L" image with only the 16 grey levels the panel can show
+
+    Antialiasing greys then land on the same level every refresh, so they
+    don't show up as changed pixels, and the driver's own 4bpp conversion
+    loses nothing.
+    """
+    pixels = np.asarray(img.convert("L"))
+    grey = grey_lut[quantize_levels(pixels, dither)]
+    return Image.frombuffer("L", img.size, grey, "raw", "L", 0, 1)
+
+
+def pack_4bpp(pixels: np.ndarray):
+    """
+    Packs levels 0 to 15 two pixels per byte, the first pixel in the high
+    nibble, padding odd widths with white. Returns a C contiguous uint8
+    array of shape (height, ceil(width / 2)) whose buffer can be written
+    out directly.
+    """
+    height, width = pixels.shape
+    if width % 2:
+        pixels = np.pad(pixels, ((0, 0), (0, 1)), constant_values=levels - 1)
+    return (pixels[:, 0::2] << 4) | pixels[:, 1::2]
+
+
+def unpack_4bpp(packed: np.ndarray, width: int):
+    """
+    Returns the levels from a pack_4bpp buffer
+    """
+    pixels = np.empty((packed.shape[0], packed.shape[1] * 2), dtype=np.uint8)
+    pixels[:, 0::2] = packed >> 4
+    pixels[:, 1::2] = packed & 0x0F
+    return pixels[:, :width]
+
+
+def pack_image(img: Image, dither: bool = False):
+    """
+    Quantizes an image to 16 levels and returns it packed as 4bpp
+    """
+    return pack_4bpp(quantize_levels(np.asarray(img.convert("L")), dither))
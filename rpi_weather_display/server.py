@@ -0,0 +1,460 @@
+import argparse
+import hashlib
+import io
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from zoneinfo import ZoneInfo
+from PIL import Image
+from .layout import orientations
+from .metrics import metrics
+
+
+logger = logging.getLogger("server")
+
+
+def grid_cell(lat: float, long: float, grid: float = 0.1):
+    """
+    Rounds a location to the centre of its grid cell so that nearby displays
+    share one forecast. 0.1 degrees is about 11 km north to south.
+    """
+    return (round(round(lat / grid) * grid, 6), round(round(long / grid) * grid, 6))
+
+
+def valid_time_zone(name: str):
+    """
+    Returns True if name is a time zone like "Europe/Berlin"
+    """
+    try:
+        ZoneInfo(name)
+    except (KeyError, OSError, ValueError):
+        return False
+    return True
+
+
+def snapshot_version(snapshot):
+    """
+    Identifies the forecast a snapshot was built from. Providers return a new
+    head() of the same snapshot on every call, which shares fetched_at.
+    """
+    return (snapshot.provider_name, snapshot.fetched_at, snapshot.stale)
+
+
+class singleFlight(object):
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function and everyone else arriving before it finishes waits for and
+    shares its result or exception
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event()}
+                self.calls[key] = call
+
+        if leader:
+            try:
+                call["result"] = func()
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call["done"].set()
+        else:
+            metrics.inc("server_coalesced_total", kind=key[0])
+            call["done"].wait()
+
+        if "error" in call:
+            raise call["error"]
+        return call["result"]
+
+
+class renderedFrame(object):
+    __slots__ = ("version", "body", "etag", "content_type", "size")
+
+    def __init__(self, version: tuple, img, fmt: str):
+        self.version = version
+        self.size = img.size
+        if fmt == "raw":
+            self.body = img.tobytes()
+            self.content_type = "application/octet-stream"
+        else:
+            buf = io.BytesIO()
+            img.save(buf, format="png", optimize=False)
+            self.body = buf.getvalue()
+            self.content_type = "image/png"
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+
+class forecastServer(object):
+    """
+    Fetches one forecast per location grid cell and renders each distinct
+    display configuration once, for many thin clients
+
+    A frame is only re-rendered when the snapshot of its cell changes, which
+    is governed by the provider's forecast cache age. Concurrent requests
+    for the same cell or frame are coalesced into one fetch and one render.
+    """
+
+    def __init__(
+            self,
+            provider: str,
+            api_key: str = None,
+            grid: float = 0.1,
+            cache=None,
+            connect_timeout: float = 5,
+            read_timeout: float = 30,
+            max_frames: int = 64,
+            hedge_after: float = 2.0,
+            max_stale: float = 24 * 3600,
+        ):
+        from .cache import forecastCache
+
+        self.provider_name = provider
+        self.api_key = api_key
+        self.grid = grid
+        self.cache = cache if cache is not None else forecastCache()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_frames = max_frames
+        self.hedge_after = hedge_after
+        self.max_stale = max_stale
+        self.lock = threading.Lock()
+        self.providers = {}
+        self.frames = OrderedDict()
+        self.flight = singleFlight()
+        # The shared matplotlib figures and panel caches are drawn into in place
+        self.render_lock = threading.Lock()
+
+    def _provider(self, cell: tuple):
+        from .providers import create_provider
+
+        with self.lock:
+            provider = self.providers.get(cell)
+        if provider is None:
+            provider = create_provider(
+                self.provider_name,
+                lat=cell[0],
+                long=cell[1],
+                api_key=self.api_key,
+                cache=self.cache,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                hedge_after=self.hedge_after,
+                max_stale=self.max_stale,
+            )
+            with self.lock:
+                provider = self.providers.setdefault(cell, provider)
+        return provider
+
+    def get_snapshot(self, lat: float, long: float):
+        """
+        Returns the current ForecastSnapshot for the grid cell of a location
+        """
+        cell = grid_cell(lat, long, self.grid)
+        return self.flight.do(("fetch", cell), lambda: self._provider(cell).get_snapshot())
+
+    def _render(self, key: tuple, snapshot):
+        from .image import render_forecast_image
+        from .quantize import quantize_image
+
+        _, time_zone_name, chart_engine, rotate, fmt = key
+        with self.render_lock, metrics.time("server_render_seconds"):
+            img = quantize_image(
+                render_forecast_image(
+                    snapshot,
+                    time_zone_name=time_zone_name,
+                    chart_engine=chart_engine,
+                    rotate=rotate,
+                )
+            )
+        frame = renderedFrame(snapshot_version(snapshot), img, fmt)
+        metrics.inc("server_frames_total", result="rendered")
+
+        with self.lock:
+            self.frames[key] = frame
+            self.frames.move_to_end(key)
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+        return frame
+
+    def get_frame(
+            self,
+            lat: float,
+            long: float,
+            time_zone_name: str = "Europe/Berlin",
+            chart_engine: str = "matplotlib",
+            rotate: int = 180,
+            fmt: str = "png",
+        ):
+        """
+        Returns a renderedFrame for a display configuration
+        """
+        snapshot = self.get_snapshot(lat, long)
+        key = (grid_cell(lat, long, self.grid), time_zone_name, chart_engine, rotate, fmt)
+
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+        if frame is not None and frame.version == snapshot_version(snapshot):
+            metrics.inc("server_frames_total", result="cached")
+            return frame
+
+        return self.flight.do(("render", key), lambda: self._render(key, snapshot))
+
+    def stats(self):
+        with self.lock:
+            return {"cells": len(self.providers), "frames": len(self.frames)}
+
+    def make_http_server(self, host: str = "0.0.0.0", port: int = 8080, defaults: dict = None):
+        """
+        Returns an HTTP server for the frames
+
+        GET /frame?lat=..&lon=..[&tz=..&engine=..&rotate=..&format=png|raw]
+        returns a frame with an ETag and answers If-None-Match with 304.
+        /metrics serves the Prometheus metrics.
+        """
+        server = self
+        defaults = dict(
+            {"tz": "Europe/Berlin", "engine": "matplotlib", "rotate": "180", "format": "png"},
+            **(defaults or {}),
+        )
+
+        class handler(BaseHTTPRequestHandler):
+            def _send(self, code: int, body: bytes, headers: dict = None):
+                self.send_response(code)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/metrics":
+                    body = metrics.to_prometheus().encode()
+                    self._send(200, body, {"Content-Type": "text/plain; version=0.0.4"})
+                elif url.path == "/frame":
+                    self._frame(parse_qs(url.query))
+                else:
+                    self.send_error(404)
+
+            do_HEAD = do_GET
+
+            def _frame(self, query: dict):
+                params = dict(defaults, **{k: v[-1] for k, v in query.items()})
+                try:
+                    lat = float(params["lat"])
+                    long = float(params["lon"])
+                    rotate = int(params["rotate"])
+                    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+                        raise ValueError(f"Location {lat},{long} is out of range")
+                    if rotate not in orientations:
+                        raise ValueError(f"Rotation must be 0 or 180, not {rotate}")
+                    if not valid_time_zone(params["tz"]):
+                        raise ValueError(f"Unknown time zone {params['tz']}")
+                    if params["engine"] not in ("matplotlib", "native"):
+                        raise ValueError(f"Unknown chart engine {params['engine']}")
+                    if params["format"] not in ("png", "raw"):
+                        raise ValueError(f"Unknown format {params['format']}")
+                except (KeyError, ValueError) as e:
+                    self._send(400, f"Bad request: {e}\n".encode(), {"Content-Type": "text/plain"})
+                    return
+
+                try:
+                    frame = server.get_frame(
+                        lat, long, params["tz"], params["engine"], rotate, params["format"]
+                    )
+                except Exception as e:
+                    logger.exception("Getting frame failed")
+                    metrics.inc("server_errors_total")
+                    self._send(502, f"Forecast unavailable: {e}\n".encode(), {"Content-Type": "text/plain"})
+                    return
+
+                headers = {
+                    "ETag": frame.etag,
+                    "Cache-Control": "no-cache",
+                    "X-Frame-Width": str(frame.size[0]),
+                    "X-Frame-Height": str(frame.size[1]),
+                }
+                if frame.etag in self.headers.get("If-None-Match", ""):
+                    metrics.inc("server_responses_total", code="304")
+                    self._send(304, b"", headers)
+                    return
+
+                headers["Content-Type"] = frame.content_type
+                metrics.inc("server_responses_total", code="200")
+                self._send(200, frame.body, headers)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return ThreadingHTTPServer((host, port), handler)
+
+
+class frameClient(object):
+    """
+    Thin client that gets ready to display frames from a forecastServer
+
+    The ETag of the last frame is sent with every request so an unchanged
+    frame costs a 304 and no decoding.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            lat: float,
+            long: float,
+            time_zone_name: str = "Europe/Berlin",
+            chart_engine: str = "matplotlib",
+            rotate: int = 180,
+            connect_timeout: float = 5,
+            read_timeout: float = 30,
+        ):
+        import requests
+
+        self.url = url.rstrip("/") + "/frame"
+        self.params = {
+            "lat": lat,
+            "lon": long,
+            "tz": time_zone_name,
+            "engine": chart_engine,
+            "rotate": rotate,
+            "format": "png",
+        }
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.etag = None
+        self.last_frame = None
+
+    def get_frame(self):
+        """
+        Returns the current frame as a PIL image
+        """
+        headers = {}
+        if self.etag and self.last_frame is not None:
+            headers["If-None-Match"] = self.etag
+
+        response = self.session.get(
+            self.url, params=self.params, headers=headers, timeout=self.timeout
+        )
+        if response.status_code == 304:
+            logger.debug("Frame not modified")
+            return self.last_frame
+        if response.status_code != 200:
+            raise Exception(
+                f"Frame request failed with status code {response.status_code}: {response.text}"
+            )
+
+        img = Image.open(io.BytesIO(response.content))
+        img.load()
+        self.last_frame = img
+        self.etag = response.headers.get("ETag")
+        return img
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves rendered weather display frames to many displays"
+    )
+    parser.add_argument("--host", help="Address to listen on", default="0.0.0.0", type=str)
+    parser.add_argument("--port", help="Port to listen on", default=8080, type=int)
+    parser.add_argument(
+        "-p",
+        "--provider",
+        help="Weather provider, 'tomorrow', 'openweather' or 'metno', or a comma "
+        "separated list of them to fall back on when one is slow or failing",
+        default="tomorrow",
+        type=str,
+    )
+    parser.add_argument(
+        "-k",
+        "--api-key",
+        help="Weather provider API key, not needed for metno. With several providers, "
+        "a comma separated list with one key per provider.",
+        type=str,
+    )
+    parser.add_argument(
+        "--hedge-after",
+        help="With several providers, seconds to wait for the best one before also "
+        "asking the next",
+        default=2.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-g",
+        "--grid",
+        help="Size in degrees of the grid cells that share a forecast",
+        default=0.1,
+        type=float,
+    )
+    parser.add_argument(
+        "-t", "--time-zone-name", help="Default time zone name.", default="Europe/Berlin", type=str
+    )
+    parser.add_argument(
+        "-c",
+        "--chart-engine",
+        help="Default engine used to draw the hourly plots",
+        default="matplotlib",
+        choices=["matplotlib", "native"],
+        type=str,
+    )
+    parser.add_argument(
+        "--max-stale",
+        help="Hours to keep serving the last forecast, marked as stale, when fetching fails",
+        default=24,
+        type=float,
+    )
+    parser.add_argument("--cache-file", help="File used to cache forecasts", default=None, type=str)
+    parser.add_argument("--connect-timeout", default=5, type=float)
+    parser.add_argument("--read-timeout", default=30, type=float)
+
+    config = parser.parse_args()
+
+    from .providers import split_providers
+
+    try:
+        split_providers(config.provider, config.api_key)
+    except ValueError as e:
+        parser.error(str(e))
+
+    from .cache import forecastCache
+    from .text import glyph_cache
+
+    forecast_server = forecastServer(
+        provider=config.provider,
+        api_key=config.api_key,
+        grid=config.grid,
+        cache=forecastCache(config.cache_file),
+        connect_timeout=config.connect_timeout,
+        read_timeout=config.read_timeout,
+        hedge_after=config.hedge_after,
+        max_stale=config.max_stale * 3600,
+    )
+    metrics.register_gauge("server", forecast_server.stats, label="kind")
+    metrics.register_gauge("text_cache", glyph_cache.stats, label="stat")
+
+    http_server = forecast_server.make_http_server(
+        config.host,
+        config.port,
+        defaults={"tz": config.time_zone_name, "engine": config.chart_engine},
+    )
+    print(f"Serving frames on http://{config.host}:{config.port}/frame")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting")
+        sys.exit(0)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import time
+import numpy as np
+from datetime import datetime, timezone
+
+
+def _epoch(t):
+    if isinstance(t, datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return int(t.timestamp())
+    return int(t)
+
+
+class ForecastSnapshot(object):
+    """
+    One fetch of forecast data in a compact columnar form
+
+    Hourly and daily forecasts are kept as NumPy arrays: times are epoch
+    seconds in UTC, temperatures and rain are floats and icons are icon
+    names like '10d'. `current` is the dict returned by get_current_weather.
+    `stale` marks a snapshot served again because fetching a newer one
+    failed.
+    Providers build one snapshot per fetch and the renderers read the
+    columns directly.
+    """
+
+    __slots__ = (
+        "provider_name",
+        "fetched_at",
+        "current",
+        "hourly_time",
+        "hourly_temperature",
+        "hourly_rain",
+        "daily_time",
+        "daily_temperature_min",
+        "daily_temperature_max",
+        "daily_rain",
+        "daily_icon",
+        "stale",
+    )
+
+    def __init__(
+            self,
+            provider_name: str = "",
+            current: dict = None,
+            hourly_time=(),
+            hourly_temperature=(),
+            hourly_rain=(),
+            daily_time=(),
+            daily_temperature_min=(),
+            daily_temperature_max=(),
+            daily_rain=(),
+            daily_icon=(),
+            fetched_at: float = None,
+            stale: bool = False,
+        ):
+        self.provider_name = provider_name
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.current = current or {}
+        self.hourly_time = np.asarray(hourly_time, dtype=np.int64)
+        self.hourly_temperature = np.asarray(hourly_temperature, dtype=np.float64)
+        self.hourly_rain = np.asarray(hourly_rain, dtype=np.float64)
+        self.daily_time = np.asarray(daily_time, dtype=np.int64)
+        self.daily_temperature_min = np.asarray(daily_temperature_min, dtype=np.float64)
+        self.daily_temperature_max = np.asarray(daily_temperature_max, dtype=np.float64)
+        self.daily_rain = np.asarray(daily_rain, dtype=np.float64)
+        self.daily_icon = np.asarray(daily_icon, dtype="<U3")
+        self.stale = stale
+
+    @classmethod
+    def from_records(
+            cls,
+            hourly: list = (),
+            daily: list = (),
+            current: dict = None,
+            provider_name: str = "",
+        ):
+        """
+        Builds a snapshot from the lists of dicts returned by get_hourly_data
+        and get_daily_data
+        """
+        return cls(
+            provider_name=provider_name,
+            current=current,
+            hourly_time=[_epoch(h["time"]) for h in hourly],
+            hourly_temperature=[h["temperature"] for h in hourly],
+            hourly_rain=[h["rain"] for h in hourly],
+            daily_time=[_epoch(d["time"]) for d in daily],
+            daily_temperature_min=[d["temperature_min"] for d in daily],
+            daily_temperature_max=[d["temperature_max"] for d in daily],
+            daily_rain=[d["rain"] for d in daily],
+            daily_icon=[d["weather_icon_name"] for d in daily],
+        )
+
+    hourly_fields = ("hourly_time", "hourly_temperature", "hourly_rain")
+    daily_fields = (
+        "daily_time",
+        "daily_temperature_min",
+        "daily_temperature_max",
+        "daily_rain",
+        "daily_icon",
+    )
+
+    def fingerprint(self, *fields):
+        """
+        Returns a hash of the given fields, so a renderer can tell if the
+        data it draws has changed since the last snapshot
+        """
+        h = hashlib.sha1()
+        for name in fields:
+            value = getattr(self, name)
+            h.update(name.encode())
+            if isinstance(value, np.ndarray):
+                h.update(value.dtype.str.encode())
+                h.update(value.tobytes())
+            else:
+                h.update(json.dumps(value, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def head(self, hours: int = 24, days: int = 7):
+        """
+        Returns a snapshot of the first hours and days, sharing the arrays
+        """
+        return ForecastSnapshot(
+            provider_name=self.provider_name,
+            current=self.current,
+            hourly_time=self.hourly_time[:hours],
+            hourly_temperature=self.hourly_temperature[:hours],
+            hourly_rain=self.hourly_rain[:hours],
+            daily_time=self.daily_time[:days],
+            daily_temperature_min=self.daily_temperature_min[:days],
+            daily_temperature_max=self.daily_temperature_max[:days],
+            daily_rain=self.daily_rain[:days],
+            daily_icon=self.daily_icon[:days],
+            fetched_at=self.fetched_at,
+            stale=self.stale,
+        )
+
+    def hourly_records(self, hours: int = 24):
+        """
+        Returns the hourly forecast as a list of dicts with local times
+        """
+        return [
+            {
+                "time": datetime.fromtimestamp(t, timezone.utc).astimezone(tz=None),
+                "temperature": float(temperature),
+                "rain": float(rain),
+            }
+            for t, temperature, rain in zip(
+                self.hourly_time[:hours].tolist(),
+                self.hourly_temperature[:hours],
+                self.hourly_rain[:hours],
+            )
+        ]
+
+    def daily_records(self, days: int = 7):
+        """
+        Returns the daily forecast as a list of dicts with naive UTC times
+        """
+        return [
+            {
+                "time": datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None),
+                "temperature_min": float(t_min),
+                "temperature_max": float(t_max),
+                "weather_icon_name": str(icon),
+                "rain": float(rain),
+            }
+            for t, t_min, t_max, icon, rain in zip(
+                self.daily_time[:days].tolist(),
+                self.daily_temperature_min[:days],
+                self.daily_temperature_max[:days],
+                self.daily_icon[:days],
+                self.daily_rain[:days],
+            )
+        ]
+
+
+def as_snapshot(data):
+    """
+    Returns data as a ForecastSnapshot, converting hourly or daily lists of
+    dicts from the older provider API
+    """
+    if isinstance(data, ForecastSnapshot):
+        return data
+    data = list(data)
+    if data and "temperature_min" in data[0]:
+        return ForecastSnapshot.from_records(daily=data)
+    return ForecastSnapshot.from_records(hourly=data)
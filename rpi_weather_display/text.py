@@ -0,0 +1,170 @@
+import logging
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+
+
+logger = logging.getLogger("text")
+
+
+class glyphCache(object):
+    """
+    Draws text by pasting cached glyph masks instead of laying out and
+    rasterizing every string with FreeType
+
+    The panels only use a small alphabet: digits, "°", "/", ".", "mm",
+    weekday names and weather descriptions. Each glyph is rasterized once
+    per font and pasted at its pen position, which gives the same pixels as
+    ImageDraw.text with Pillow's basic layout, where advances are whole
+    pixels. Pairs of glyphs whose combined advance differs, e.g. from
+    kerning, and anything else the fast path can't reproduce exactly, fall
+    back to ImageDraw.text.
+    """
+
+    def __init__(self, max_glyphs: int = 1024):
+        self.max_glyphs = max_glyphs
+        self.glyphs = OrderedDict()
+        self.pairs = {}
+        self.line_spacing = {}
+        self.fast = 0
+        self.fallback = 0
+        self.lock = threading.Lock()
+
+    def _font_key(self, font):
+        return (font.path, font.size, font.index)
+
+    def _glyph(self, font, font_key: tuple, char: str):
+        """
+        Returns (mask, offset, advance) for a character, mask is None for
+        blank glyphs
+        """
+        key = font_key + (char,)
+        with self.lock:
+            glyph = self.glyphs.get(key)
+            if glyph is not None:
+                self.glyphs.move_to_end(key)
+                return glyph
+
+        core, offset = font.getmask2(char, "L")
+        mask = None
+        if core.size[0] and core.size[1]:
+            mask = Image.frombytes("L", core.size, bytes(core))
+        glyph = (mask, offset, font.getlength(char))
+
+        with self.lock:
+            self.glyphs[key] = glyph
+            while len(self.glyphs) > self.max_glyphs:
+                self.glyphs.popitem(last=False)
+        return glyph
+
+    def _pair_ok(self, font, font_key: tuple, pair: str, advances: float):
+        """
+        Returns True if a pair of glyphs is laid out with just their advances
+        """
+        key = font_key + (pair,)
+        ok = self.pairs.get(key)
+        if ok is None:
+            ok = font.getlength(pair) == advances
+            self.pairs[key] = ok
+        return ok
+
+    def _layout(self, font, text: str, align: str, spacing: int):
+        """
+        Returns a list of (x, y, glyphs) lines relative to the text origin,
+        or None if the text can't be drawn exactly from cached glyphs
+        """
+        font_key = self._font_key(font)
+        lines = []
+        for line in text.split("\n"):
+            glyphs = [self._glyph(font, font_key, char) for char in line]
+            for i, (_, _, advance) in enumerate(glyphs):
+                if not float(advance).is_integer():
+                    return None
+                if i and not self._pair_ok(
+                    font, font_key, line[i - 1 : i + 1], glyphs[i - 1][2] + advance
+                ):
+                    return None
+            lines.append((int(sum(g[2] for g in glyphs)), glyphs))
+
+        if font_key not in self.line_spacing:
+            self.line_spacing[font_key] = font.getbbox("A")[3]
+        line_spacing = self.line_spacing[font_key] + spacing
+
+        max_width = max(width for width, _ in lines)
+        placed = []
+        for i, (width, glyphs) in enumerate(lines):
+            if align == "right":
+                x = max_width - width
+            elif align == "center":
+                x = int((max_width - width) / 2.0)
+            else:
+                x = 0
+            placed.append((x, i * line_spacing, glyphs))
+        return placed
+
+    def _can_blit(self, img, xy: tuple, font, fill, spacing):
+        return (
+            img.mode == "L"
+            and isinstance(font, ImageFont.FreeTypeFont)
+            and font.layout_engine == ImageFont.Layout.BASIC
+            and isinstance(fill, int)
+            and all(isinstance(v, int) for v in xy)
+            and isinstance(spacing, int)
+        )
+
+    def draw(
+            self,
+            img: Image,
+            xy: tuple,
+            text: str,
+            font,
+            fill: int = 0,
+            align: str = "left",
+            spacing: int = 4,
+        ):
+        """
+        Draws text like ImageDraw.Draw(img).text(xy, text, ...)
+        """
+        placed = None
+        if self._can_blit(img, xy, font, fill, spacing):
+            placed = self._layout(font, text, align, spacing)
+
+        if placed is None:
+            self.fallback += 1
+            ImageDraw.Draw(img).text(
+                xy, text, font=font, fill=fill, align=align, spacing=spacing
+            )
+            return
+
+        self.fast += 1
+        for line_x, line_y, glyphs in placed:
+            x = xy[0] + line_x
+            y = xy[1] + line_y
+            for mask, offset, advance in glyphs:
+                if mask is not None:
+                    img.paste(fill, (x + offset[0], y + offset[1]), mask)
+                x += int(advance)
+
+    def stats(self):
+        """
+        Returns how often text was drawn from cached glyphs
+        """
+        with self.lock:
+            glyphs = len(self.glyphs)
+        return {"fast": self.fast, "fallback": self.fallback, "glyphs": glyphs}
+
+    def clear(self):
+        with self.lock:
+            self.glyphs.clear()
+            self.pairs.clear()
+            self.line_spacing.clear()
+
+
+glyph_cache = glyphCache()
+
+
+def draw_text(img: Image, xy: tuple, text: str, font, fill: int = 0, align: str = "left"):
+    """
+    Draws text into an image using the shared glyph cache
+    """
+    glyph_cache.draw(img, xy, text, font, fill=fill, align=align)
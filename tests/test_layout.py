@@ -0,0 +1,37 @@
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+from rpi_weather_display.backends import nullDisplay
+from rpi_weather_display.layout import layoutEngine
+
+
+def sample_panels():
+    panels = {}
+    for name, size in [("current", (1448, 180)), ("daily", (1448, 320)), ("hourly", (1448, 572))]:
+        img = Image.new("L", size, color=255)
+        ImageDraw.Draw(img).rectangle((10, 10, size[0] - 10, size[1] - 10), outline=0, width=4)
+        panels[name] = img
+    return panels
+
+
+@pytest.mark.parametrize("rotate", [0, 180])
+def test_frame_fills_the_display_uncropped(rotate):
+    frame = layoutEngine().compose(sample_panels(), rotate=rotate)
+    display = nullDisplay()
+    display.paste_image(frame)
+
+    assert frame.size == (display.width, display.height)
+    assert ImageChops.difference(display.last_frame, frame).getbbox() is None
+
+
+def test_180_is_the_upright_frame_turned_around():
+    engine = layoutEngine()
+    upright = engine.compose(sample_panels(), rotate=0)
+    turned = engine.compose(sample_panels(), rotate=180)
+
+    assert ImageChops.difference(upright.transpose(Image.ROTATE_180), turned).getbbox() is None
+
+
+@pytest.mark.parametrize("rotate", [90, 270, 45])
+def test_rotations_the_panel_cannot_show_are_rejected(rotate):
+    with pytest.raises(ValueError):
+        layoutEngine().compose(sample_panels(), rotate=rotate)
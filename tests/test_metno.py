@@ -0,0 +1,61 @@
+import json
+import os
+import time
+from datetime import date
+import pytest
+from rpi_weather_display.cache import forecastCache
+from rpi_weather_display.providers.metno import metNorway
+
+
+fixture_path = os.path.join(
+    os.path.dirname(__file__), "..", "benchmarks", "fixtures", "metno_compact.json"
+)
+
+
+@pytest.fixture
+def time_zone(request):
+    """
+    Sets the process' local time zone for one test
+    """
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = request.param
+    time.tzset()
+    yield request.param
+    if previous is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+def load_provider():
+    with open(fixture_path, encoding="utf-8") as f:
+        forecast = json.load(f)
+    cache = forecastCache(persist=False)
+    provider = metNorway(52.52, 13.405, cache=cache)
+    cache.set(
+        provider.cache_key,
+        {"forecast": forecast, "last_modified": None, "expires": time.time() + 3600},
+        ttl=3600,
+    )
+    return provider
+
+
+@pytest.mark.parametrize(
+    "time_zone", ["UTC", "Europe/Berlin", "Asia/Tokyo", "America/Los_Angeles"], indirect=True
+)
+def test_daily_dates_are_local_days(time_zone):
+    provider = load_provider()
+    days = provider.get_daily_data(days=10)
+    dates = [d["time"].date() for d in days]
+
+    first = provider._parse_time(provider.timeseries[0]["time"])
+    last = provider._parse_time(provider.timeseries[-1]["time"])
+    first_day = date.fromtimestamp(first)
+    last_day = date.fromtimestamp(last)
+
+    assert dates[0] == first_day
+    assert dates[-1] == last_day
+    assert len(dates) == (last_day - first_day).days + 1
+    assert all((b - a).days == 1 for a, b in zip(dates, dates[1:]))
+    assert all(d["time"].hour == 0 and d["time"].minute == 0 for d in days)